@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+"""
+HTTP load and regression harness for the Layer Resume web server
+
+Starts LayerResumeHTTPHandler on a free local port against a temporary fake
+home tree with generated G-code files, replays GUI sessions (list, select,
+analyze, process, save, download) and checks per-endpoint latency and peak
+memory against a budgets file.
+"""
+
+import sys
+import os
+import argparse
+import json
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+import http.client
+from http.server import ThreadingHTTPServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import start_at_layer_web as web
+
+DEFAULT_BUDGETS_PATH = os.path.join(SCRIPT_DIR, 'layer_resume_budgets.json')
+DEFAULT_TOLERANCE = 0.2
+
+def generate_gcode(filepath, layers, moves_per_layer, seed=0):
+    """Write a PrusaSlicer-style G-code file with LAYER_CHANGE comments."""
+    rng = random.Random(seed)
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write("; generated by layer_resume_bench.py\n")
+        f.write("G90\nM83\nG28\nG1 Z5 F3000\n")
+        f.write("; Filament gcode\n")
+        z = 0.0
+        for _ in range(layers):
+            z = round(z + 0.2, 2)
+            f.write(f";LAYER_CHANGE\n;Z:{z}\n;HEIGHT:0.2\nG1 Z{z} F600\n")
+            x, y = 100.0, 100.0
+            for _ in range(moves_per_layer):
+                x = min(max(x + rng.uniform(-5, 5), 0.0), 220.0)
+                y = min(max(y + rng.uniform(-5, 5), 0.0), 220.0)
+                f.write(f"G1 X{x:.3f} Y{y:.3f} E{rng.uniform(0.01, 0.3):.5f} F{rng.choice((1800, 3000, 6000))}\n")
+            f.write(f"G1 Z{z + 0.4:.2f} F600\nG1 X50 Y50 F12000\nG1 Z{z:.2f}\n")
+        f.write("M104 S0\nM140 S0\n")
+
+def build_fake_home(root, file_count, layers, moves_per_layer):
+    """Create a fake home tree under root and point the server module at it."""
+    gcodes_dir = os.path.join(root, 'printer_data', 'gcodes')
+    config_dir = os.path.join(root, 'printer_data', 'config')
+    os.makedirs(gcodes_dir)
+    os.makedirs(config_dir)
+
+    printer_cfg = os.path.join(SCRIPT_DIR, '..', 'printer.cfg')
+    if os.path.exists(printer_cfg):
+        shutil.copy(printer_cfg, config_dir)
+
+    files = []
+    for i in range(file_count):
+        filepath = os.path.join(gcodes_dir, f"bench_{i}.gcode")
+        generate_gcode(filepath, layers, moves_per_layer, seed=i)
+        files.append(filepath)
+
+    web.configure_printer_roots([('bench', root)])
+    web.auto_shutdown = False
+    return files
+
+def start_server():
+    """Serve LayerResumeHTTPHandler on a free local port in a background thread."""
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), web.LayerResumeHTTPHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    return httpd, httpd.server_address[1]
+
+def post(connection, path, payload):
+    """POST JSON to path, returning (status, body); download bodies are discarded."""
+    body = json.dumps(payload).encode('utf-8')
+    connection.request('POST', path, body=body, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    if path == '/api/download-file':
+        while response.read(1024 * 1024):
+            pass
+        return response.status, None
+    return response.status, response.read()
+
+def run_session(port, filepath, session_id, record):
+    """Replay one GUI session, calling record(endpoint, seconds) after every request."""
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=600)
+    gcodes_dir = web.printer_roots[0].gcodes_dir
+    output_dir = os.path.join(gcodes_dir, 'bench_output', str(session_id))
+
+    def call(path, payload):
+        start = time.perf_counter()
+        status, body = post(connection, path, payload)
+        record(path, time.perf_counter() - start)
+        if status != 200:
+            raise RuntimeError(f"{path} returned HTTP {status}: {body[:200] if body else ''}")
+        return json.loads(body) if body else None
+
+    try:
+        call('/api/files', {'path': gcodes_dir})
+        analysis = call('/api/analyze-layers', {'filepath': filepath})
+        layers = analysis['layers']
+        # Same layer choice for the same session on every run
+        layer = layers[random.Random(str(session_id)).randrange(len(layers))]
+        call('/api/file-lines', {'filepath': filepath, 'start': max(1, layer['lineNumber'] - 10),
+                                 'end': layer['lineNumber'] + 30})
+        result = call('/api/process', {'filepath': filepath, 'target_z': layer['zHeight'],
+                                       'original_filename': os.path.basename(filepath),
+                                       'omit_content': True})
+        saved = call('/api/save-file', {'filename': result['filename'], 'content': result['content'],
+                                        'cache_key': result.get('cache_key', ''),
+                                        'directory': output_dir})
+        call('/api/download-file', {'filepath': saved['filepath']})
+    finally:
+        connection.close()
+
+def run_load(port, files, sessions, concurrency):
+    """Run sessions spread over concurrency threads; return latencies per endpoint and errors."""
+    latencies = {}
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(sessions))
+
+    def record(path, seconds):
+        with lock:
+            latencies.setdefault(path, []).append(seconds)
+
+    def worker():
+        while True:
+            with lock:
+                session_id = next(counter, None)
+            if session_id is None:
+                return
+            try:
+                run_session(port, files[session_id % len(files)], session_id, record)
+            except Exception as e:
+                with lock:
+                    errors.append(f"session {session_id}: {e}")
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+def measure_peak_memory(port, files):
+    """Replay one session per file sequentially, recording the traced peak per endpoint.
+
+    Runs separately from the load phase because tracemalloc slows everything down.
+    Line indexes and cached resume files are dropped first so the pass is cold.
+    """
+    peaks = {}
+    for root in web.printer_roots:
+        with root.line_index_lock:
+            root.line_index_cache.clear()
+    if web.resume_cache:
+        web.resume_cache = web.ResumeCache(web.resume_cache.cache_dir + '_memory')
+
+    def record(path, seconds):
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[path] = max(peaks.get(path, 0), peak)
+        tracemalloc.reset_peak()
+
+    tracemalloc.start()
+    try:
+        for i, filepath in enumerate(files):
+            tracemalloc.reset_peak()
+            run_session(port, filepath, f"memory_{i}", record)
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summarize(latencies, peaks):
+    """Combine latencies (seconds) and peaks (bytes) into per-endpoint metrics."""
+    summary = {}
+    for path in sorted(set(latencies) | set(peaks)):
+        values = latencies.get(path, [])
+        metrics = {}
+        if values:
+            metrics['count'] = len(values)
+            metrics['p50_ms'] = round(percentile(values, 0.5) * 1000, 2)
+            metrics['p95_ms'] = round(percentile(values, 0.95) * 1000, 2)
+            metrics['max_ms'] = round(max(values) * 1000, 2)
+        if path in peaks:
+            metrics['peak_mb'] = round(peaks[path] / (1024 * 1024), 3)
+        summary[path] = metrics
+    return summary
+
+def check_budgets(summary, budgets, tolerance, slack_ms, slack_mb):
+    """Return a list of budget violations beyond tolerance.
+
+    Both metrics also get an absolute slack so very small budgets do not fail on jitter.
+    """
+    slack = {'p95_ms': slack_ms, 'peak_mb': slack_mb}
+    failures = []
+    for path, budget in budgets.get('endpoints', {}).items():
+        measured = summary.get(path, {})
+        for metric in ('p95_ms', 'peak_mb'):
+            if metric not in budget or metric not in measured:
+                continue
+            limit = max(budget[metric] * (1 + tolerance), budget[metric] + slack[metric])
+            if measured[metric] > limit:
+                failures.append(f"{path} {metric}: {measured[metric]} > {limit:.2f} "
+                                f"(budget {budget[metric]} + {tolerance:.0%})")
+    return failures
+
+def print_summary(summary):
+    print(f"{'Endpoint':<22}{'Count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'peak MB':>10}")
+    for path, metrics in summary.items():
+        print(f"{path:<22}{metrics.get('count', '-'):>7}{metrics.get('p50_ms', '-'):>10}"
+              f"{metrics.get('p95_ms', '-'):>10}{metrics.get('max_ms', '-'):>10}{metrics.get('peak_mb', '-'):>10}")
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="HTTP load and regression harness for the Layer Resume web server",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Usage:
+  Record a baseline:  python3 layer_resume_bench.py --write-budgets
+  Check for regressions:  python3 layer_resume_bench.py
+  Heavier load:  python3 layer_resume_bench.py --sessions 40 --concurrency 8 --layers 500
+
+Exits with status 1 when an endpoint's p95 latency or peak memory exceeds its
+budget by more than the tolerance, or when any request fails. Without
+--write-budgets it also exits with status 1 when the budgets file is missing
+or was recorded with a different workload, since there is nothing to compare.
+        """
+    )
+    parser.add_argument('--sessions', type=int, default=12,
+                       help='Number of GUI sessions to replay (default: 12)')
+    parser.add_argument('--concurrency', type=int, default=4,
+                       help='Concurrent sessions (default: 4)')
+    parser.add_argument('--files', type=int, default=3,
+                       help='Number of generated G-code files (default: 3)')
+    parser.add_argument('--layers', type=int, default=200,
+                       help='Layers per generated file (default: 200)')
+    parser.add_argument('--moves-per-layer', type=int, default=500,
+                       help='Extrusion moves per layer (default: 500)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Run without the resume file cache')
+    parser.add_argument('--no-memory', action='store_true',
+                       help='Skip the peak memory pass')
+    parser.add_argument('--budgets', default=DEFAULT_BUDGETS_PATH,
+                       help=f'Budgets file (default: {DEFAULT_BUDGETS_PATH})')
+    parser.add_argument('--tolerance', type=float, default=None,
+                       help=f'Allowed regression over budget (default: from budgets file or {DEFAULT_TOLERANCE})')
+    parser.add_argument('--slack-ms', type=float, default=25.0,
+                       help='Absolute latency slack on top of the budget (default: 25)')
+    parser.add_argument('--slack-mb', type=float, default=2.0,
+                       help='Absolute peak memory slack on top of the budget (default: 2)')
+    parser.add_argument('--write-budgets', action='store_true',
+                       help='Store the measured values as the new budgets')
+    parser.add_argument('--keep-tree', action='store_true',
+                       help='Do not delete the temporary home tree')
+
+    args = parser.parse_args()
+    workload = {
+        'sessions': args.sessions,
+        'concurrency': args.concurrency,
+        'files': args.files,
+        'layers': args.layers,
+        'moves_per_layer': args.moves_per_layer,
+        'cache': not args.no_cache
+    }
+
+    budgets = None
+    if not args.write_budgets:
+        if not os.path.exists(args.budgets):
+            print(f"❌ No budgets file at {args.budgets} - run with --write-budgets to record a baseline")
+            return 1
+        with open(args.budgets, 'r', encoding='utf-8') as f:
+            budgets = json.load(f)
+        if budgets.get('workload') != workload:
+            print(f"❌ Workload differs from the one the budgets were recorded with: {budgets.get('workload')}")
+            print("   Use the recorded workload, or run with --write-budgets to record a new baseline")
+            return 1
+
+    root = tempfile.mkdtemp(prefix='layer_resume_bench_')
+    httpd = None
+    try:
+        print(f"📁 Generating {args.files} G-code files in {root}...")
+        files = build_fake_home(root, args.files, args.layers, args.moves_per_layer)
+        if not args.no_cache:
+            web.resume_cache = web.ResumeCache(web.printer_roots[0].resume_cache_dir)
+        httpd, port = start_server()
+        print(f"🌐 Server: http://127.0.0.1:{port}")
+
+        print(f"🔄 Replaying {args.sessions} sessions with concurrency {args.concurrency}...")
+        start = time.perf_counter()
+        latencies, errors = run_load(port, files, args.sessions, args.concurrency)
+        elapsed = time.perf_counter() - start
+        print(f"⏱️  Load phase: {elapsed:.2f}s ({args.sessions / elapsed:.2f} sessions/s)")
+
+        peaks = {}
+        if not args.no_memory:
+            print("📈 Measuring peak memory per endpoint...")
+            peaks = measure_peak_memory(port, files)
+
+        summary = summarize(latencies, peaks)
+        print_summary(summary)
+        if web.resume_cache:
+            print(f"💾 Cache: {web.resume_cache.stats()}")
+    finally:
+        if httpd:
+            httpd.shutdown()
+            httpd.server_close()
+        if args.keep_tree:
+            print(f"📁 Kept temporary tree: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    for error in errors:
+        print(f"❌ {error}")
+
+    if args.write_budgets:
+        tolerance = args.tolerance if args.tolerance is not None else DEFAULT_TOLERANCE
+        budgets = {
+            'tolerance': tolerance,
+            'workload': workload,
+            'endpoints': {path: {metric: metrics[metric] for metric in ('p95_ms', 'peak_mb') if metric in metrics}
+                          for path, metrics in summary.items()}
+        }
+        with open(args.budgets, 'w', encoding='utf-8') as f:
+            json.dump(budgets, f, indent=2)
+        print(f"✅ Budgets written to {args.budgets}")
+        return 1 if errors else 0
+
+    tolerance = args.tolerance if args.tolerance is not None else budgets.get('tolerance', DEFAULT_TOLERANCE)
+
+    failures = check_budgets(summary, budgets, tolerance, args.slack_ms, args.slack_mb)
+    for failure in failures:
+        print(f"❌ Budget exceeded: {failure}")
+    if failures or errors:
+        return 1
+    print(f"✅ All endpoints within budget (tolerance {tolerance:.0%})")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+"""
+Differential equivalence checker for the Layer Resume processing engines
+
+Runs the legacy in-memory engine (process_gcode_content, the reference oracle)
+and a candidate engine over a corpus of real and synthetic G-code files at many
+target Z heights, in parallel across cores. Outputs are compared by streaming
+hash; on a mismatch the first differing line is reported. Throughput of both
+engines is reported side by side.
+"""
+
+import sys
+import os
+import argparse
+import gzip
+import hashlib
+import importlib
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import start_at_layer_web as web
+from layer_resume_bench import generate_gcode
+
+class HashSink:
+    """Writable binary stream that only keeps a running hash and byte count."""
+
+    def __init__(self):
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.digest.update(data)
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+def load_engine(spec):
+    """Return the engine function named by 'module:function'."""
+    module_name, _, function_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), function_name)
+
+def generate_corpus(directory, layers, moves_per_layer):
+    """Write synthetic files covering the dialects and encodings the engines must agree on."""
+    plain = os.path.join(directory, 'synthetic.gcode')
+    generate_gcode(plain, layers, moves_per_layer, seed=1)
+    with open(plain, 'rb') as f:
+        data = f.read()
+
+    layer_numbers = iter(range(1000000))
+    cura = re.sub(rb';LAYER_CHANGE\n;Z:[\d.]+\n', lambda m: b';LAYER:%d\n' % next(layer_numbers), data)
+    layer_numbers = iter(range(1, 1000000))
+    simplify3d = re.sub(rb';LAYER_CHANGE\n;Z:([\d.]+)\n',
+                        lambda m: b'; layer %d, Z = %s\n' % (next(layer_numbers), m.group(1)), data)
+
+    variants = {
+        'synthetic_crlf.gcode': data.replace(b'\n', b'\r\n'),
+        'synthetic_no_trailing_newline.gcode': data.rstrip(b'\n'),
+        # No LAYER_CHANGE comments: exercises the Z move fallback
+        'synthetic_z_moves_only.gcode': data.replace(b';LAYER_CHANGE', b';NO_LAYER_MARKER'),
+        # Klipper-style start block: a relative Z lift must not turn M83 extrusion absolute.
+        # Constant E words never increase, so they only extrude when read as relative
+        'synthetic_z_moves_g91_lift.gcode': re.sub(rb' E[\d.]+ ', b' E0.5 ', data).replace(
+            b';LAYER_CHANGE', b';NO_LAYER_MARKER').replace(b'G1 Z5 F3000\n', b'G91\nG1 Z5 F3000\nG90\n', 1),
+        # Complete-object print: the second object repeats the first one's Z heights
+        'synthetic_sequential.gcode': data + data[data.index(b';LAYER_CHANGE'):],
+        'synthetic_cura.gcode': cura,
+        'synthetic_simplify3d.gcode': simplify3d,
+        'synthetic_exec_blocks.gcode': data.replace(
+            b'; Filament gcode\n',
+            b'; Filament gcode\n; EXECUTABLE_BLOCK_START\nG1 Z10\nG28 X\n; EXECUTABLE_BLOCK_END\n', 1)
+    }
+    files = [plain]
+    for name, content in variants.items():
+        filepath = os.path.join(directory, name)
+        with open(filepath, 'wb') as f:
+            f.write(content)
+        files.append(filepath)
+
+    compressed = plain + '.gz'
+    with open(plain, 'rb') as src, gzip.open(compressed, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    files.append(compressed)
+
+    compressed = plain + '.zst'
+    if write_zstd(plain, compressed):
+        files.append(compressed)
+    else:
+        print("⚠️  Skipping .gcode.zst: needs Python 3.14+ or the 'zstandard' package")
+    return files
+
+def write_zstd(source, destination):
+    """Compress source to destination with whichever zstd module is available."""
+    try:
+        from compression import zstd
+        with open(source, 'rb') as src, zstd.ZstdFile(destination, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        return True
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        return False
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        zstandard.ZstdCompressor().copy_stream(src, dst)
+    return True
+
+def collect_files(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, _, names in os.walk(path):
+                files.extend(os.path.join(dirpath, name) for name in sorted(names) if web.is_gcode_file(name))
+        elif web.is_gcode_file(path):
+            files.append(path)
+    return files
+
+def pick_targets(filepath, count):
+    """Return (target Z, layer index) pairs spread over the file, plus out-of-range ones.
+    
+    Z targets have no layer index; layer targets (first, middle, last and one
+    past the end) have no Z.
+    """
+    index = web.get_line_index(filepath)
+    layer_count = len(index['layers'])
+    heights = sorted({layer['zHeight'] for layer in index['layers']})
+    if not heights:
+        return [(0.2, None)]
+    step = max(1, len(heights) // count)
+    targets = heights[::step][:count]
+    # Between two layers, below the first and above the last
+    if len(heights) > 1:
+        targets.append(round((heights[0] + heights[1]) / 2, 4))
+    targets += [0.0, heights[-1] + 10.0]
+    layer_indexes = sorted({0, layer_count // 2, layer_count - 1, layer_count})
+    return [(target_z, None) for target_z in targets] + [(None, i) for i in layer_indexes]
+
+def call_engine(engine, filepath, target, output):
+    target_z, layer_index = target
+    if layer_index is None:
+        return engine(filepath, target_z, output, os.path.basename(filepath))
+    return engine(filepath, target_z, output, os.path.basename(filepath), layer_index=layer_index)
+
+def run_engine(engine, filepath, target, output):
+    """Run engine, returning (result, error message)."""
+    try:
+        return call_engine(engine, filepath, target, output), None
+    except ValueError as e:
+        return None, str(e)
+
+def first_difference(oracle, candidate, filepath, target):
+    """Regenerate both outputs and return (line number, oracle line, candidate line)."""
+    with tempfile.TemporaryFile() as expected, tempfile.TemporaryFile() as actual:
+        call_engine(oracle, filepath, target, expected)
+        call_engine(candidate, filepath, target, actual)
+        expected.seek(0)
+        actual.seek(0)
+        line_number = 0
+        while True:
+            line_number += 1
+            expected_line = expected.readline()
+            actual_line = actual.readline()
+            if expected_line != actual_line:
+                return line_number, expected_line, actual_line
+            if not expected_line:
+                return None
+
+def check_file(filepath, candidate_spec, oracle_spec, target_count, require_layers=False):
+    """Compare both engines on one file at many targets (runs in a worker process).
+    
+    Both engines share the layer detector, so with require_layers a file
+    where it finds no layers at all is reported too (synthetic files always have some).
+    """
+    oracle = load_engine(oracle_spec)
+    candidate = load_engine(candidate_spec)
+    targets = pick_targets(filepath, target_count)
+    report = {'filepath': filepath, 'targets': len(targets), 'mismatches': [],
+              'oracle_seconds': 0.0, 'candidate_seconds': 0.0, 'bytes': 0}
+    if require_layers and not web.get_line_index(filepath)['layers']:
+        report['mismatches'].append("no layers detected")
+
+    # The index is built once per file; count it against the candidate
+    with web.line_index_lock:
+        web.line_index_cache.pop(filepath, None)
+
+    for target in targets:
+        expected = HashSink()
+        start = time.perf_counter()
+        expected_result, expected_error = run_engine(oracle, filepath, target, expected)
+        report['oracle_seconds'] += time.perf_counter() - start
+
+        actual = HashSink()
+        start = time.perf_counter()
+        actual_result, actual_error = run_engine(candidate, filepath, target, actual)
+        report['candidate_seconds'] += time.perf_counter() - start
+        report['bytes'] += expected.size
+
+        mismatch = None
+        if expected_error or actual_error:
+            if expected_error != actual_error:
+                mismatch = f"error differs: oracle={expected_error!r} candidate={actual_error!r}"
+        elif expected.digest.digest() != actual.digest.digest():
+            difference = first_difference(oracle, candidate, filepath, target)
+            if difference:
+                line_number, expected_line, actual_line = difference
+                mismatch = (f"output differs at line {line_number}: "
+                            f"oracle={expected_line[:120]!r} candidate={actual_line[:120]!r}")
+        elif expected_result['stats'] != actual_result['stats']:
+            mismatch = f"stats differ: oracle={expected_result['stats']} candidate={actual_result['stats']}"
+        elif expected_result['filename'] != actual_result['filename']:
+            mismatch = f"filename differs: {expected_result['filename']} != {actual_result['filename']}"
+
+        if mismatch:
+            label = f"Z={target[0]}" if target[1] is None else f"layer {target[1]}"
+            report['mismatches'].append(f"{label}: {mismatch}")
+
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Differential equivalence checker for the Layer Resume processing engines",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Usage:
+  Synthetic corpus only:  python3 layer_resume_diffcheck.py
+  Real prints too:        python3 layer_resume_diffcheck.py /home/biqu/printer_data/gcodes
+  Other candidate:        python3 layer_resume_diffcheck.py --candidate my_engine:process_gcode_file
+
+Engines take (filepath, target_z, binary_output, original_filename) plus a
+layer_index keyword, and return a result dict with 'filename' and 'stats',
+like process_gcode_file().
+Exits with status 1 when any output differs from the oracle.
+        """
+    )
+    parser.add_argument('paths', nargs='*',
+                       help='G-code files or directories to include in the corpus')
+    parser.add_argument('--candidate', default='start_at_layer_web:process_gcode_file',
+                       help='Candidate engine as module:function (default: the streaming engine)')
+    parser.add_argument('--oracle', default='start_at_layer_web:process_gcode_file_legacy',
+                       help='Reference engine as module:function (default: the legacy engine)')
+    parser.add_argument('--targets', type=int, default=20,
+                       help='Target Z heights sampled per file (default: 20)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                       help='Worker processes (default: number of cores)')
+    parser.add_argument('--no-synthetic', action='store_true',
+                       help='Do not generate the synthetic corpus')
+    parser.add_argument('--layers', type=int, default=100,
+                       help='Layers per synthetic file (default: 100)')
+    parser.add_argument('--moves-per-layer', type=int, default=300,
+                       help='Extrusion moves per synthetic layer (default: 300)')
+
+    args = parser.parse_args()
+
+    corpus_dir = tempfile.mkdtemp(prefix='layer_resume_diffcheck_')
+    try:
+        files = collect_files(args.paths)
+        synthetic = []
+        if not args.no_synthetic:
+            synthetic = generate_corpus(corpus_dir, args.layers, args.moves_per_layer)
+            files += synthetic
+        if not files:
+            print("❌ No G-code files to check")
+            return 1
+
+        print(f"🔍 Checking {len(files)} files: {args.candidate} against {args.oracle}")
+        reports = []
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(check_file, filepath, args.candidate, args.oracle, args.targets,
+                                       filepath in synthetic)
+                       for filepath in files]
+            for future in as_completed(futures):
+                report = future.result()
+                reports.append(report)
+                ratio = report['oracle_seconds'] / max(report['candidate_seconds'], 1e-9)
+                status = '✅' if not report['mismatches'] else '❌'
+                print(f"{status} {os.path.basename(report['filepath'])}: {report['targets']} targets, "
+                      f"oracle {report['oracle_seconds']:.2f}s, candidate {report['candidate_seconds']:.2f}s "
+                      f"({ratio:.1f}x)")
+                for mismatch in report['mismatches']:
+                    print(f"     {mismatch}")
+    finally:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    oracle_seconds = sum(report['oracle_seconds'] for report in reports)
+    candidate_seconds = sum(report['candidate_seconds'] for report in reports)
+    megabytes = sum(report['bytes'] for report in reports) / (1024 * 1024)
+    mismatches = sum(len(report['mismatches']) for report in reports)
+    print("=" * 70)
+    print(f"📊 Output: {megabytes:.1f} MB")
+    print(f"   Oracle:    {megabytes / max(oracle_seconds, 1e-9):.1f} MB/s")
+    print(f"   Candidate: {megabytes / max(candidate_seconds, 1e-9):.1f} MB/s "
+          f"({oracle_seconds / max(candidate_seconds, 1e-9):.1f}x)")
+    if mismatches:
+        print(f"❌ {mismatches} mismatches")
+        return 1
+    print("✅ All outputs match the oracle")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
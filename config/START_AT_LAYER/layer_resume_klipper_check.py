@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Checks for the START_AT_LAYER Klipper extras module without a printer
+
+Loads start_at_layer.py with minimal fake printer, reactor, gcode and
+virtual_sdcard objects and runs the Z, BYTE, no-argument (virtual_sdcard
+position) and PRINT=1 paths against a generated G-code file outside any
+printer root, as the module's files usually are. Reactor
+callbacks are run the way Klipper would, so an exception escaping one of
+them fails the check instead of shutting klippy down.
+"""
+
+import sys
+import os
+import argparse
+import shutil
+import tempfile
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, SCRIPT_DIR)
+
+import start_at_layer
+from layer_resume_bench import generate_gcode
+
+class CommandError(Exception):
+    pass
+
+class FakeReactor:
+    def __init__(self):
+        self.callbacks = []
+    def monotonic(self):
+        return 0.
+    def register_async_callback(self, callback):
+        self.callbacks.append(callback)
+    def run_pending(self):
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self.monotonic())
+
+class FakeGCode:
+    error = CommandError
+    def __init__(self):
+        self.commands = {}
+        self.messages = []
+        self.scripts = []
+        self.script_error = None  # Raised by run_script when set
+    def register_command(self, name, handler, desc=None):
+        self.commands[name] = handler
+    def respond_info(self, message):
+        self.messages.append(message)
+    def run_script(self, script):
+        self.scripts.append(script)
+        if self.script_error:
+            raise self.error(self.script_error)
+
+class FakeCommand:
+    error = CommandError
+    def __init__(self, params):
+        self.params = params
+        self.messages = []
+    def respond_info(self, message):
+        self.messages.append(message)
+    def get(self, name, default=None):
+        return self.params.get(name, default)
+    def get_float(self, name, default=None, above=None, **kwargs):
+        value = self.params.get(name)
+        return default if value is None else float(value)
+    def get_int(self, name, default=None, minval=None, maxval=None):
+        value = self.params.get(name)
+        return default if value is None else int(value)
+
+class FakeSDCard:
+    def __init__(self):
+        self.file_path = None
+        self.file_position = 0
+    def get_status(self, eventtime):
+        return {'file_path': self.file_path, 'file_position': self.file_position}
+
+class FakePrinter:
+    def __init__(self, config_file):
+        self.reactor = FakeReactor()
+        self.objects = {'gcode': FakeGCode(), 'virtual_sdcard': FakeSDCard()}
+        self.config_file = config_file
+    def get_reactor(self):
+        return self.reactor
+    def lookup_object(self, name, default=None):
+        return self.objects.get(name, default)
+    def get_start_args(self):
+        return {'config_file': self.config_file}
+
+class FakeConfig:
+    def __init__(self, printer, options):
+        self.printer = printer
+        self.options = options
+    def get_printer(self):
+        return self.printer
+    def get(self, name, default=None):
+        return self.options.get(name, default)
+
+def run_command(module, printer, params):
+    """Run START_AT_LAYER, wait for its worker and run the reactor callbacks it queued."""
+    module.cmd_START_AT_LAYER(FakeCommand(params))
+    worker = module.worker
+    if worker is not None:
+        worker.join()
+    printer.reactor.run_pending()
+
+def run_checks(root):
+    gcodes_dir = os.path.join(root, 'gcodes')
+    os.makedirs(gcodes_dir)
+    source = os.path.join(gcodes_dir, 'part.gcode')
+    generate_gcode(source, 20, 50, seed=1)
+    with open(source, 'rb') as f:
+        source_data = f.read()
+    layer_five = source_data.index(b';LAYER_CHANGE\n;Z:1.0\n')
+
+    printer = FakePrinter(os.path.join(SCRIPT_DIR, '..', 'printer.cfg'))
+    module = start_at_layer.load_config(FakeConfig(printer, {'path': gcodes_dir}))
+    gcode = printer.lookup_object('gcode')
+    sdcard = printer.lookup_object('virtual_sdcard')
+    failures = []
+
+    def check(name, condition, detail=''):
+        print(f"{'✅' if condition else '❌'} {name}" + (f": {detail}" if detail and not condition else ''))
+        if not condition:
+            failures.append(name)
+
+    run_command(module, printer, {'FILE': 'part.gcode', 'Z': '1.0'})
+    check("Z=1.0 writes a resume file", module.state == 'done'
+          and os.path.exists(os.path.join(gcodes_dir, module.output)), module.message)
+    cached = start_at_layer.start_at_layer_web.line_index_cache.get(source)
+    check("The layer index uses klippy's printer.cfg", cached is not None
+          and cached['key'][2] == printer.config_file)
+
+    run_command(module, printer, {'FILE': 'part.gcode', 'BYTE': str(layer_five + 100)})
+    check("BYTE inside layer 5 resumes at that layer", module.state == 'done'
+          and 'layer5_' in module.output, module.message)
+
+    sdcard.file_path = source
+    sdcard.file_position = layer_five + 100
+    run_command(module, printer, {})
+    check("No arguments resume the virtual_sdcard position", module.state == 'done'
+          and 'layer5_' in module.output, module.message)
+
+    run_command(module, printer, {'FILE': 'part.gcode', 'Z': '1.0', 'PRINT': '1'})
+    check("PRINT=1 starts the resume file", module.state == 'done'
+          and gcode.scripts[-1] == f'SDCARD_PRINT_FILE FILENAME="{module.output}"', module.message)
+
+    gcode.script_error = "SD busy"
+    try:
+        run_command(module, printer, {'FILE': 'part.gcode', 'Z': '1.0', 'PRINT': '1'})
+        check("PRINT=1 failure is reported, not raised", module.state == 'error'
+              and 'SD busy' in module.message, module.message)
+    except CommandError as e:
+        check("PRINT=1 failure is reported, not raised", False, f"escaped the reactor callback: {e}")
+    gcode.script_error = None
+
+    try:
+        run_command(module, printer, {'FILE': 'part.gcode', 'Z': '1.0', 'OUTPUT': 'part.gcode'})
+        rejected = False
+    except CommandError:
+        rejected = True
+    with open(source, 'rb') as f:
+        unchanged = f.read() == source_data
+    check("OUTPUT equal to FILE is rejected", rejected and unchanged)
+
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks for the START_AT_LAYER Klipper extras module with fake Klipper objects")
+    parser.add_argument('--keep-tree', action='store_true',
+                       help='Do not delete the temporary gcodes tree')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='layer_resume_klipper_check_')
+    try:
+        failures = run_checks(root)
+    finally:
+        if args.keep_tree:
+            print(f"📁 Kept temporary tree: {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if failures:
+        print(f"❌ {len(failures)} checks failed")
+        return 1
+    print("✅ All START_AT_LAYER checks passed")
+    return 0
+
+if __name__ == "__main__":
+    exit(main())
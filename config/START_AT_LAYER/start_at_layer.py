@@ -0,0 +1,159 @@
+# Klipper extras module: generate "start at layer" resume files in-process
+#
+# Install by linking this file into klippy/extras, next to the other extras:
+#   ln -s /home/biqu/printer_data/config/START_AT_LAYER/start_at_layer.py ~/klipper/klippy/extras/
+# then add to printer.cfg:
+#   [start_at_layer]
+#   #path: /home/biqu/printer_data/gcodes
+#   #printer_config: (defaults to the printer.cfg klippy was started with)
+#
+# Usage:
+#   START_AT_LAYER FILE=my_print.gcode Z=12.4 [OUTPUT=name.gcode] [PRINT=1]
+#   START_AT_LAYER FILE=my_print.gcode BYTE=1234567   (or LINE=45678)
+#   START_AT_LAYER   (resume the last virtual_sdcard file at its file_position)
+import sys
+import os
+import threading
+import logging
+
+# The resume engine lives next to the real (not the linked) location of this file
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import start_at_layer_web
+
+class StartAtLayer:
+    cmd_START_AT_LAYER_help = "Write a copy of a G-code file that resumes at a Z height"
+    def __init__(self, config):
+        self.printer = config.get_printer()
+        self.reactor = self.printer.get_reactor()
+        self.gcode = self.printer.lookup_object('gcode')
+        self.gcodes_dir = os.path.normpath(os.path.expanduser(
+            config.get('path', start_at_layer_web.GCODES_DIR)))
+        # Machine limits for the print-time estimates in the layer index
+        self.printer_cfg_path = config.get(
+            'printer_config', self.printer.get_start_args().get('config_file'))
+        self.lock = threading.Lock()
+        self.worker = None
+        self.state = 'idle'
+        self.message = ''
+        self.output = ''
+        self.gcode.register_command('START_AT_LAYER', self.cmd_START_AT_LAYER,
+                                    desc=self.cmd_START_AT_LAYER_help)
+    def get_status(self, eventtime):
+        return {'state': self.state, 'message': self.message,
+                'output': self.output}
+    def _resolve(self, filename):
+        filepath = os.path.normpath(os.path.join(self.gcodes_dir, filename))
+        if not filepath.startswith(self.gcodes_dir + os.sep):
+            raise self.gcode.error("START_AT_LAYER: FILE must be inside %s"
+                                   % (self.gcodes_dir,))
+        return filepath
+    def _sdcard_position(self, gcmd):
+        sdcard = self.printer.lookup_object('virtual_sdcard', None)
+        if sdcard is None:
+            raise gcmd.error("START_AT_LAYER: Z, BYTE or LINE is required")
+        status = sdcard.get_status(self.reactor.monotonic())
+        if not status.get('file_path') or not status.get('file_position'):
+            raise gcmd.error("START_AT_LAYER: no interrupted print to resume")
+        return status['file_path'], status['file_position']
+    def cmd_START_AT_LAYER(self, gcmd):
+        target_z = gcmd.get_float('Z', None, above=0.)
+        byte_offset = gcmd.get_int('BYTE', None, minval=0)
+        line_number = gcmd.get_int('LINE', None, minval=1)
+        filename = gcmd.get('FILE', None)
+        if target_z is None and byte_offset is None and line_number is None:
+            sd_path, byte_offset = self._sdcard_position(gcmd)
+            if filename is None:
+                filename = sd_path
+        if filename is None:
+            raise gcmd.error("START_AT_LAYER: FILE is required")
+        filepath = self._resolve(filename)
+        output_name = gcmd.get('OUTPUT', None)
+        start_print = gcmd.get_int('PRINT', 0, minval=0, maxval=1)
+        if not os.path.exists(filepath):
+            raise gcmd.error("START_AT_LAYER: file not found: %s" % (filepath,))
+        if output_name is not None and self._resolve(output_name) == filepath:
+            raise gcmd.error("START_AT_LAYER: OUTPUT must differ from FILE")
+        with self.lock:
+            if self.worker is not None:
+                raise gcmd.error("START_AT_LAYER: a resume file is already"
+                                 " being generated")
+            self.state = 'running'
+            if target_z is not None:
+                self.message = "Generating resume file for Z=%.3f" % (
+                    target_z,)
+            elif byte_offset is not None:
+                self.message = ("Generating resume file from byte %d"
+                                % (byte_offset,))
+            else:
+                self.message = ("Generating resume file from line %d"
+                                % (line_number,))
+            self.output = ''
+            # Heavy lifting happens off the reactor thread
+            self.worker = threading.Thread(
+                target=self._generate,
+                args=(filepath, target_z, byte_offset, line_number,
+                      output_name, start_print))
+            self.worker.daemon = True
+            self.worker.start()
+        gcmd.respond_info("START_AT_LAYER: %s" % (self.message,))
+    def _generate(self, filepath, target_z, byte_offset, line_number,
+                  output_name, start_print):
+        # Runs in the background thread; never touch gcode/printer here
+        tmp_path = os.path.join(self.gcodes_dir,
+                                '.start_at_layer.%d.tmp' % (os.getpid(),))
+        try:
+            layer_index = None
+            if target_z is None:
+                # Resume by layer, as Z can repeat in sequential prints
+                layer_index = start_at_layer_web.find_resume_layer(
+                    filepath, byte_offset, line_number, self.printer_cfg_path)
+            with open(tmp_path, 'wb') as f:
+                result = start_at_layer_web.process_gcode_file(
+                    filepath, target_z, f, layer_index=layer_index,
+                    printer_cfg_path=self.printer_cfg_path)
+            output_path = self._resolve(output_name or result['filename'])
+            if output_path == filepath:
+                raise self.gcode.error("START_AT_LAYER: OUTPUT must differ"
+                                       " from FILE")
+            os.replace(tmp_path, output_path)
+            os.chmod(output_path, 0o644)
+        except Exception as e:
+            logging.exception("START_AT_LAYER failed")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            error = str(e)
+            self.reactor.register_async_callback(
+                (lambda et: self._finish(None, None, error, False)))
+            return
+        self.reactor.register_async_callback(
+            (lambda et: self._finish(output_path, result, None, start_print)))
+    def _finish(self, output_path, result, error, start_print):
+        # Runs in the reactor thread
+        with self.lock:
+            self.worker = None
+        if error is not None:
+            self.state = 'error'
+            self.message = error
+            self.gcode.respond_info("START_AT_LAYER failed: %s" % (error,))
+            return
+        stats = result['stats']
+        self.state = 'done'
+        self.output = os.path.relpath(output_path, self.gcodes_dir)
+        self.message = ("Wrote %s starting at Z=%s (line %d)"
+                        % (self.output, stats['actual_z'],
+                           stats['target_line'] + 1))
+        self.gcode.respond_info("START_AT_LAYER: %s" % (self.message,))
+        if start_print:
+            # Errors must not escape into the reactor (e.g. "SD busy")
+            try:
+                self.gcode.run_script("SDCARD_PRINT_FILE FILENAME=\"%s\""
+                                      % (self.output,))
+            except self.gcode.error as e:
+                self.state = 'error'
+                self.message = "Could not start %s: %s" % (self.output,
+                                                          str(e))
+                self.gcode.respond_info("START_AT_LAYER failed: %s"
+                                        % (self.message,))
+
+def load_config(config):
+    return StartAtLayer(config)
@@ -8,8 +8,18 @@ import re
 import argparse
 import os
 import json
+import math
+import hashlib
+import shutil
+import bisect
+import gzip
+import io
+import struct
+import zlib
+from collections import deque, OrderedDict
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import threading
 import urllib.parse
 import mimetypes
@@ -18,10 +28,84 @@ import subprocess
 import socket
 import webbrowser
 import time
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None  # Per-layer time/filament estimates are skipped without numpy
 
 # Global server reference for shutdown
 server_instance = None
 shutdown_timer = None
+auto_shutdown = True  # Exit 30 seconds after a file is saved
+use_legacy_engine = False  # Process files with process_gcode_content (reference oracle)
+
+# Locations on the printer host; the GUI is served from next to this script
+HOME_DIR = '/home/biqu'
+GCODES_DIR = '/home/biqu/printer_data/gcodes'
+HTML_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'layer_resume_gui.html')
+
+# Printer homes served by this instance; farm mode (--root) serves several
+DEFAULT_ROOT_NAME = 'veho'
+WORKERS_PER_ROOT = 1  # Concurrent analyze/process jobs per printer
+MAX_WORKERS = 4  # Concurrent analyze/process jobs in total
+printer_roots = []
+job_scheduler = None
+
+# Generated resume files are cached by content hash (see ResumeCache), by default
+# in the first printer root's printer_data/resume_cache
+ENGINE_VERSION = '2'  # Bump whenever process_gcode_content output changes
+RESUME_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+resume_cache = None
+
+# Sparse line index: one byte-offset checkpoint every LINE_INDEX_STEP lines
+LINE_INDEX_STEP = 1000
+MAX_WINDOW_LINES = 5000
+line_index_cache = {}
+line_index_lock = threading.Lock()
+line_index_building = {}  # filepath -> Event set when its in-flight build ends
+
+# Toolpath previews: Float32 segments per (file, layer), least recently used evicted first
+TOOLPATH_CACHE_ENTRIES = 256
+toolpath_cache = OrderedDict()
+toolpath_cache_lock = threading.Lock()
+
+# Machine limits used for print-time estimates (overridden from each root's printer.cfg)
+PRINTER_CFG_PATH = os.path.join(HOME_DIR, 'printer_data', 'config', 'printer.cfg')
+DEFAULT_PRINTER_LIMITS = {
+    'max_velocity': 300.0,
+    'max_accel': 3000.0,
+    'max_z_velocity': 5.0,
+    'max_z_accel': 100.0,
+    'square_corner_velocity': 5.0,
+    'filament_diameter': 1.75
+}
+FILAMENT_DENSITY = 1.24  # g/cm^3 (PLA)
+
+# Plain G-code files accepted as input; compressed and binary ones come from GCODE_CODECS
+PLAIN_GCODE_EXTENSIONS = ('.gcode', '.g')
+
+# Patterns to match LAYER_CHANGE and Z: comments
+LAYER_CHANGE_PATTERN = re.compile(r';\s*LAYER_CHANGE', re.IGNORECASE)
+Z_HEIGHT_PATTERN = re.compile(r';\s*Z:\s*(\d+\.?\d*)', re.IGNORECASE)
+
+# Layer markers of the other slicer dialects (see LayerDetector)
+CURA_LAYER_PATTERN = re.compile(r'^;\s*LAYER:\s*(-?\d+)', re.IGNORECASE)
+S3D_LAYER_PATTERN = re.compile(r'^;\s*layer\s+(\d+),\s*Z\s*=\s*(\d+\.?\d*)', re.IGNORECASE)
+EXTRUSION_WORD_PATTERN = re.compile(r'E\s*(-?\d*\.?\d+)', re.IGNORECASE)
+
+# Patterns used by the resume pipeline (shared by both processing engines)
+FILAMENT_START_MARKER = '; Filament gcode'
+G28_PATTERN = re.compile(r'^\s*G28', re.IGNORECASE)
+Z_MOVE_PATTERN = re.compile(r'^\s*G[01]\s+.*Z', re.IGNORECASE)
+Z_FALLBACK_PATTERN = re.compile(r'G[01]\s+.*Z(\d+\.?\d*)', re.IGNORECASE)
+EXEC_BLOCK_START_PATTERN = re.compile(r';\s*EXECUTABLE_BLOCK_START', re.IGNORECASE)
+EXEC_BLOCK_END_PATTERN = re.compile(r';\s*EXECUTABLE_BLOCK_END', re.IGNORECASE)
+
+# Patterns for motion commands used by the print-time estimate
+MOTION_COMMAND_PATTERN = re.compile(r'^(G0|G1|G90|G91|G92|M82|M83)(?!\d)', re.IGNORECASE)
+AXIS_WORD_PATTERN = re.compile(r'([XYZEF])\s*(-?\d*\.?\d+)', re.IGNORECASE)
 
 class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
     """Custom HTTP handler for the layer resume web interface."""
@@ -29,8 +113,7 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
     def do_GET(self):
         """Handle GET requests for serving files."""
         if self.path == '/' or self.path == '/layer_resume_gui.html':
-            html_path = '/home/biqu/printer_data/config/START_AT_LAYER/layer_resume_gui.html'
-            self.serve_file(html_path)
+            self.serve_file(HTML_PATH)
         else:
             self.send_404()
     
@@ -49,6 +132,10 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
                 self.handle_get_file_content(post_data)
             elif self.path == '/api/analyze-layers':
                 self.handle_analyze_layers(post_data)
+            elif self.path == '/api/file-lines':
+                self.handle_get_file_lines(post_data)
+            elif self.path == '/api/toolpath':
+                self.handle_get_toolpath(post_data)
             elif self.path == '/api/save-file':
                 self.handle_save_file(post_data)
             elif self.path == '/api/queue-print':
@@ -57,6 +144,10 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
                 self.handle_download_file(post_data)
             elif self.path == '/api/process':
                 self.handle_process_gcode(post_data)
+            elif self.path == '/api/cache-stats':
+                self.handle_cache_stats(post_data)
+            elif self.path == '/api/roots':
+                self.handle_list_roots(post_data)
             elif self.path == '/api/terminate':
                 self.handle_terminate_server(post_data)
             else:
@@ -114,33 +205,36 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
     
     def handle_list_files(self, post_data):
         """Handle file listing requests."""
+        default_directory = printer_roots[0].gcodes_dir
         try:
             if post_data:
                 data = json.loads(post_data.decode('utf-8'))
-                directory = data.get('path', '/home/biqu/printer_data/gcodes')
+                directory = data.get('path', default_directory)
             else:
-                directory = '/home/biqu/printer_data/gcodes'
+                directory = default_directory
         except json.JSONDecodeError as e:
             print(f"JSON decode error: {e}")
-            directory = '/home/biqu/printer_data/gcodes'
+            directory = default_directory
         
         # Sanitize and validate path
         directory = os.path.abspath(directory)
         
-        if not directory.startswith('/home/biqu'):
-            directory = '/home/biqu/printer_data/gcodes'
+        root = find_printer_root(directory)
+        if root is None:
+            directory = default_directory
+            root = printer_roots[0]
         
         files = []
         
         try:
             if not os.path.exists(directory):
-                directory = '/home/biqu/printer_data/gcodes'
+                directory = root.gcodes_dir
             
             if not os.path.isdir(directory):
                 raise ValueError(f"Path is not a directory: {directory}")
             
-            # Add parent directory entry if not at root
-            if directory != '/home/biqu' and directory != '/':
+            # Add parent directory entry if not at the printer's home
+            if directory != root.home_dir and directory != '/':
                 files.append({
                     'name': '..',
                     'type': 'directory',
@@ -174,7 +268,7 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
                     }
                     
                     # Include all directories and G-code files
-                    if is_dir or item.lower().endswith(('.gcode', '.g')):
+                    if is_dir or is_gcode_file(item):
                         files.append(file_info)
                         
                 except (OSError, PermissionError) as e:
@@ -201,18 +295,16 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             raise ValueError("Invalid JSON in request")
         
         # Sanitize path
-        filepath = os.path.abspath(filepath)
-        if not filepath.startswith('/home/biqu'):
-            raise ValueError("Access denied: Invalid file path")
+        filepath = resolve_printer_path(filepath)
         
         if not os.path.exists(filepath):
             raise ValueError(f"File not found: {filepath}")
         
-        if not filepath.lower().endswith(('.gcode', '.g')):
-            raise ValueError("Invalid file type - only .gcode and .g files are supported")
+        if not is_gcode_file(filepath):
+            raise ValueError(f"Invalid file type - only {', '.join(gcode_extensions())} files are supported")
         
         try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
+            with io.TextIOWrapper(open_gcode_stream(filepath), encoding='utf-8', errors='ignore') as f:
                 content = f.read()
             
             self.send_response(200)
@@ -224,11 +316,91 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
         except Exception as e:
             raise ValueError(f"Failed to read file: {str(e)}")
     
+    def handle_get_file_lines(self, post_data):
+        """Handle requests for a window of lines [start, end) of a file."""
+        try:
+            data = json.loads(post_data.decode('utf-8'))
+            filepath = data.get('filepath', '')
+            start = int(data.get('start', 1))
+            end = int(data.get('end', start + 100))
+        except (json.JSONDecodeError, ValueError, TypeError):
+            raise ValueError("Invalid JSON in request")
+        
+        # Sanitize path
+        filepath = resolve_printer_path(filepath)
+        
+        if not os.path.exists(filepath):
+            raise ValueError(f"File not found: {filepath}")
+        
+        index = get_line_index(filepath)
+        start = max(1, start)
+        end = min(end, start + MAX_WINDOW_LINES, index['total_lines'] + 1)
+        lines = read_line_window(filepath, index, start, end)
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        response = {
+            'start': start,
+            'end': start + len(lines),
+            'total_lines': index['total_lines'],
+            'lines': lines
+        }
+        self.wfile.write(json.dumps(response).encode('utf-8'))
+    
+    def handle_get_toolpath(self, post_data):
+        """Handle toolpath preview requests for one layer, answered as packed Float32 segments."""
+        try:
+            data = json.loads(post_data.decode('utf-8'))
+            filepath = data.get('filepath', '')
+            layer_number = int(data.get('layer', 0))
+            include_previous = bool(data.get('include_previous', False))
+        except (json.JSONDecodeError, ValueError, TypeError) as e:
+            self.send_error_response(f"Invalid request data: {str(e)}")
+            return
+        
+        try:
+            filepath = resolve_printer_path(filepath)
+            if not os.path.exists(filepath):
+                raise ValueError(f"File not found: {filepath}")
+            if np is None:
+                raise ValueError("Toolpath preview requires numpy")
+            
+            index = get_line_index(filepath)
+            layers = index['layers']
+            if not 0 <= layer_number < len(layers):
+                raise ValueError(f"Layer {layer_number} out of range (0-{len(layers) - 1})")
+            
+            segments = get_layer_toolpath(filepath, index, layer_number)
+            if include_previous and layer_number > 0:
+                # Only the extrusions of the previous layer, marked as such
+                previous = get_layer_toolpath(filepath, index, layer_number - 1)
+                previous = previous[previous[:, 4] == TOOLPATH_EXTRUDE]
+                previous[:, 4] = TOOLPATH_PREVIOUS
+                segments = np.concatenate((previous, segments))
+            body = segments.tobytes()
+            
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.send_header('Access-Control-Expose-Headers', 'X-Segment-Count, X-Layer-Z')
+            self.send_header('X-Segment-Count', str(len(segments)))
+            self.send_header('X-Layer-Z', str(layers[layer_number]['zHeight']))
+            self.end_headers()
+            self.wfile.write(body)
+            
+        except Exception as e:
+            print(f"Error building toolpath preview: {e}")
+            self.send_error_response(f"Failed to build toolpath preview: {str(e)}")
+    
     def handle_analyze_layers(self, post_data):
         """Handle layer analysis requests."""
         try:
             data = json.loads(post_data.decode('utf-8'))
             content = data.get('content', '')
+            filepath = data.get('filepath', '')
             
         except json.JSONDecodeError as e:
             print(f"JSON decode error: {e}")
@@ -236,13 +408,24 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             return
         
         try:
-            # Process directly
-            layers = find_layer_changes(content)
+            if filepath:
+                # Stream the file from disk and build the line index on the way
+                filepath = resolve_printer_path(filepath)
+                index = get_line_index(filepath)
+                layers = index['layers']
+                dialect = index['dialect']
+                total_lines = index['total_lines']
+            else:
+                # Process directly
+                dialect, layers = detect_layers(content.split('\n'))
+                total_lines = content.count('\n') + 1
             
             # Send simple response with the layers array
             response_data = {
                 'layers': layers,
                 'count': len(layers),
+                'dialect': dialect,
+                'total_lines': total_lines,
                 'status': 'complete',
                 'progress': 100
             }
@@ -266,14 +449,15 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             data = json.loads(post_data.decode('utf-8'))
             filename = data.get('filename', '')
             content = data.get('content', '')
-            directory = data.get('directory', '/home/biqu/printer_data/gcodes')
+            cache_key = data.get('cache_key', '')
+            directory = data.get('directory', printer_roots[0].gcodes_dir)
         except json.JSONDecodeError:
             self.send_error_response("Invalid JSON in request")
             return
         
         # Sanitize inputs
         directory = os.path.abspath(directory)
-        if not directory.startswith('/home/biqu'):
+        if find_printer_root(directory) is None:
             self.send_error_response("Access denied: Invalid directory path")
             return
         
@@ -284,7 +468,7 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             return
         
         # Ensure filename has .gcode extension if it doesn't have one already
-        if not filename.lower().endswith(('.gcode', '.g')):
+        if not is_gcode_file(filename):
             if '.' in filename:
                 # Replace existing extension with .gcode
                 filename = os.path.splitext(filename)[0] + '.gcode'
@@ -298,12 +482,19 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             # Ensure directory exists
             os.makedirs(directory, exist_ok=True)
             
-            # Write file
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(content)
-            
-            # Set appropriate permissions
-            os.chmod(filepath, 0o644)
+            cached_path = resume_cache.get(cache_key) if resume_cache and cache_key else None
+            if cached_path:
+                # Link the cached output into place instead of rewriting it
+                resume_cache.materialize(cached_path, filepath)
+            elif cache_key and not content:
+                raise ValueError("Cached output is no longer available - please process the file again")
+            else:
+                # Write file
+                with open(filepath, 'w', encoding='utf-8') as f:
+                    f.write(content)
+                
+                # Set appropriate permissions
+                os.chmod(filepath, 0o644)
             
             # Start shutdown timer after successful file save (processing complete)
             schedule_server_shutdown()
@@ -316,7 +507,8 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
                 'success': True, 
                 'filepath': filepath, 
                 'filename': filename,
-                'size': len(content.encode('utf-8')),
+                'size': os.path.getsize(filepath),
+                'cached': bool(cached_path),
                 'shutdown_in_seconds': 30
             }
             self.wfile.write(json.dumps(response).encode('utf-8'))
@@ -336,9 +528,7 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             raise ValueError("Invalid JSON in request")
         
         # Sanitize path
-        filepath = os.path.abspath(filepath)
-        if not filepath.startswith('/home/biqu'):
-            raise ValueError("Access denied: Invalid file path")
+        filepath = resolve_printer_path(filepath)
         
         if not os.path.exists(filepath):
             raise ValueError(f"File not found: {filepath}")
@@ -380,25 +570,22 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             raise ValueError("Invalid JSON in request")
         
         # Sanitize path
-        filepath = os.path.abspath(filepath)
-        if not filepath.startswith('/home/biqu'):
-            raise ValueError("Access denied: Invalid file path")
+        filepath = resolve_printer_path(filepath)
         
         if not os.path.exists(filepath):
             raise ValueError(f"File not found: {filepath}")
         
         try:
-            with open(filepath, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
-            
             filename = os.path.basename(filepath)
             
             self.send_response(200)
             self.send_header('Content-type', 'application/octet-stream')
+            self.send_header('Content-Length', str(os.path.getsize(filepath)))
             self.send_header('Access-Control-Allow-Origin', '*')
             self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
             self.end_headers()
-            self.wfile.write(content.encode('utf-8'))
+            with open(filepath, 'rb') as f:
+                shutil.copyfileobj(f, self.wfile, 1024 * 1024)
             
         except Exception as e:
             raise ValueError(f"Failed to download file: {str(e)}")
@@ -410,8 +597,20 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             
             # Extract parameters
             content = data.get('content', '')
+            filepath = data.get('filepath', '')
             target_z = float(data.get('target_z', 0))
-            original_filename = data.get('original_filename', 'unknown.gcode')
+            layer_index = data.get('layer_index')
+            byte_offset = data.get('byte_offset')
+            line_number = data.get('line_number')
+            if layer_index is not None:
+                layer_index = int(layer_index)
+            if byte_offset is not None:
+                byte_offset = int(byte_offset)
+            if line_number is not None:
+                line_number = int(line_number)
+            original_filename = data.get('original_filename')
+            omit_content = bool(data.get('omit_content', False))
+            compress = bool(data.get('compress_output', False))
             
         except (json.JSONDecodeError, KeyError, ValueError) as e:
             print(f"Error parsing request: {e}")
@@ -419,8 +618,70 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             return
         
         try:
-            # Process the G-code directly
-            result = process_gcode_content(content, target_z, original_filename)
+            cache_key = None
+            result = None
+            if filepath:
+                # Stream the file from disk instead of receiving its content
+                filepath = resolve_printer_path(filepath)
+                if not os.path.exists(filepath):
+                    raise ValueError(f"File not found: {filepath}")
+                original_filename = original_filename or os.path.basename(filepath)
+                
+                # Index first: the build is a job of its own and must not wait inside this one
+                get_line_index(filepath)
+                with job_scheduler.job(find_printer_root(filepath)):
+                    if byte_offset is not None or line_number is not None:
+                        # Resume the layer where the print stopped instead of at a guessed Z
+                        layer_index = find_resume_layer(filepath, byte_offset, line_number)
+                    
+                    index = get_line_index(filepath)
+                    fingerprint = index['fingerprint']
+                    engine = process_gcode_file_legacy if use_legacy_engine else process_gcode_file
+                    options = {'original_filename': original_filename, 'compress': compress,
+                               'engine': engine.__name__}
+                    if layer_index is not None:
+                        target_z = find_target_layer(index['layers'], target_z, layer_index)[1]
+                        options['layer_index'] = layer_index
+                    
+                    def write_output(f):
+                        return engine(filepath, target_z, f, original_filename, compress, layer_index)
+                    
+                    if resume_cache:
+                        cache_key = resume_cache.make_key(fingerprint, target_z, options)
+                        result = resume_cache.load(cache_key, with_content=not omit_content and not compress)
+                        if result is None:
+                            result = dict(resume_cache.put_file(cache_key, write_output), content='')
+                            if not omit_content and not compress:
+                                with open(resume_cache.path_for(cache_key), 'r', encoding='utf-8') as f:
+                                    result['content'] = f.read()
+                    elif compress:
+                        raise ValueError("Compressed output requires the resume cache")
+                    else:
+                        output = io.BytesIO()
+                        result = write_output(output)
+                        result['content'] = output.getvalue().decode('utf-8', errors='ignore')
+            else:
+                if byte_offset is not None or line_number is not None:
+                    raise ValueError("byte_offset and line_number require a filepath")
+                original_filename = original_filename or 'unknown.gcode'
+                if resume_cache:
+                    options = {'original_filename': original_filename}
+                    if layer_index is not None:
+                        options['layer_index'] = layer_index
+                    cache_key = resume_cache.make_key(content_fingerprint(content), target_z, options)
+                    result = resume_cache.load(cache_key, with_content=not omit_content)
+                
+                if result is None:
+                    # Process the G-code directly
+                    result = process_gcode_content(content, target_z, original_filename, layer_index)
+                    if resume_cache:
+                        resume_cache.put(cache_key, result)
+            
+            if cache_key:
+                result['cache_key'] = cache_key
+                if omit_content:
+                    # The client saves by cache key, so skip sending the output back
+                    result = dict(result, content='')
             
             # Send response with result
             self.send_response(200)
@@ -435,6 +696,26 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
             traceback.print_exc()
             self.send_error_response(f"Failed to process G-code: {str(e)}")
     
+    def handle_cache_stats(self, post_data):
+        """Handle resume cache statistics requests."""
+        stats = resume_cache.stats() if resume_cache else {'enabled': False}
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(stats).encode('utf-8'))
+    
+    def handle_list_roots(self, post_data):
+        """Handle requests for the printer roots served by this instance."""
+        roots = job_scheduler.stats() if job_scheduler else [root.info() for root in printer_roots]
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(roots).encode('utf-8'))
+    
     def handle_terminate_server(self, post_data):
         """Handle immediate server termination requests."""
         try:
@@ -468,6 +749,7 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
                 global server_instance
                 if server_instance:
                     threading.Thread(target=server_instance.shutdown, daemon=True).start()
+                flush_resume_cache()
                 os._exit(0)
             
             shutdown_timer = threading.Timer(2.0, immediate_shutdown)
@@ -490,10 +772,342 @@ class LayerResumeHTTPHandler(BaseHTTPRequestHandler):
         """Override to suppress default HTTP logging."""
         pass
 
+class PrinterRoot:
+    """One printer's home directory (the one holding printer_data).
+    
+    Each root keeps its own layer index cache and worker quota, so a farm of
+    printers mounted on one host do not evict or starve each other.
+    """
+    
+    def __init__(self, name, home_dir, workers=WORKERS_PER_ROOT):
+        self.name = name
+        self.home_dir = os.path.abspath(home_dir)
+        self.gcodes_dir = os.path.join(self.home_dir, 'printer_data', 'gcodes')
+        self.printer_cfg_path = os.path.join(self.home_dir, 'printer_data', 'config', 'printer.cfg')
+        self.resume_cache_dir = os.path.join(self.home_dir, 'printer_data', 'resume_cache')
+        self.workers = workers
+        self.line_index_cache = {}
+        self.line_index_lock = threading.Lock()
+        self.line_index_building = {}
+        self.running = 0
+        self.waiting = deque()  # Events of jobs waiting for a worker, oldest first
+    
+    def contains(self, path):
+        return path == self.home_dir or path.startswith(self.home_dir + os.sep)
+    
+    def info(self):
+        return {
+            'name': self.name,
+            'home_dir': self.home_dir,
+            'gcodes_dir': self.gcodes_dir,
+            'workers': self.workers,
+            'running': self.running,
+            'waiting': len(self.waiting),
+            'indexed_files': len(self.line_index_cache)
+        }
+
+class JobScheduler:
+    """Admits heavy jobs (layer analysis, resume generation) fairly across printer roots.
+    
+    At most max_workers jobs run at once and at most root.workers per root.
+    Whenever a worker frees up, roots with waiting jobs are served round-robin,
+    so a queue of big files on one printer cannot starve recovery on another.
+    A job started while the thread already runs one is part of that job.
+    """
+    
+    def __init__(self, roots, max_workers=MAX_WORKERS):
+        self.roots = roots
+        self.max_workers = max_workers
+        self.running = 0
+        self.turn = 0  # Root that gets the next free worker
+        self.lock = threading.Lock()
+        self.local = threading.local()
+    
+    def in_job(self):
+        """Return True when the calling thread is running a job."""
+        return getattr(self.local, 'in_job', False)
+    
+    @contextmanager
+    def job(self, root):
+        """Block until root may start another job, then run the with-block as that job."""
+        if self.in_job():
+            yield
+            return
+        ticket = threading.Event()
+        with self.lock:
+            root.waiting.append(ticket)
+            self._dispatch()
+        ticket.wait()
+        self.local.in_job = True
+        try:
+            yield
+        finally:
+            self.local.in_job = False
+            with self.lock:
+                root.running -= 1
+                self.running -= 1
+                self._dispatch()
+    
+    def stats(self):
+        with self.lock:
+            return [dict(root.info(), max_workers=self.max_workers) for root in self.roots]
+    
+    def _dispatch(self):
+        while self.running < self.max_workers:
+            for i in range(len(self.roots)):
+                root = self.roots[(self.turn + i) % len(self.roots)]
+                if root.waiting and root.running < root.workers:
+                    root.running += 1
+                    self.running += 1
+                    root.waiting.popleft().set()
+                    self.turn = (self.turn + i + 1) % len(self.roots)
+                    break
+            else:
+                return
+
+def configure_printer_roots(roots, workers_per_root=WORKERS_PER_ROOT, max_workers=MAX_WORKERS):
+    """Serve the given (name, home_dir) pairs, the first one being the default."""
+    global printer_roots, job_scheduler
+    printer_roots = [PrinterRoot(name, home_dir, workers_per_root) for name, home_dir in roots]
+    job_scheduler = JobScheduler(printer_roots, max_workers)
+
+def find_printer_root(path):
+    """Return the PrinterRoot containing the absolute path, or None."""
+    for root in printer_roots:
+        if root.contains(path):
+            return root
+    return None
+
+def resolve_printer_path(path):
+    """Return path made absolute, raising ValueError unless it is inside a printer root."""
+    path = os.path.abspath(path)
+    if find_printer_root(path) is None:
+        raise ValueError("Access denied: Invalid file path")
+    return path
+
+class ResumeCache:
+    """Content-addressed cache of generated resume files with LRU eviction.
+    
+    Entries are keyed by a hash of the source content, target Z, processing
+    options and ENGINE_VERSION. Each entry is stored as <key>.gcode in the
+    cache directory; index.json keeps the stats of every entry in LRU order
+    so the cache survives server restarts. The total size of the cached files
+    is kept under max_bytes by evicting the least recently used entries.
+    
+    The LRU order is kept in memory: index.json is rewritten when entries are
+    added or evicted, at most every INDEX_SAVE_INTERVAL seconds for hits, and
+    by flush() on shutdown.
+    """
+    
+    INDEX_SAVE_INTERVAL = 30.0
+    
+    def __init__(self, cache_dir, max_bytes=RESUME_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, 'index.json')
+        self.lock = threading.Lock()
+        self.entries = {}  # key -> {'size', 'filename', 'stats'}, least recently used first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.index_dirty = False
+        self.index_saved_at = time.monotonic()
+        
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+    
+    def make_key(self, fingerprint, target_z, options=None):
+        """Return the cache key for processing the source with this fingerprint at target_z."""
+        digest = hashlib.sha256(fingerprint.encode('utf-8'))
+        params = {
+            'target_z': float(target_z),
+            'options': options or {},
+            'engine': ENGINE_VERSION
+        }
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+    
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}.gcode")
+    
+    def get(self, key):
+        """Return the cached file path for key (marking it recently used), or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            path = self.path_for(key)
+            if entry is None or not os.path.exists(path):
+                if self.entries.pop(key, None) is not None:
+                    self.index_dirty = True
+                self.misses += 1
+                return None
+            # Move to the most recently used end
+            self.entries[key] = self.entries.pop(key)
+            self.hits += 1
+            self.index_dirty = True
+            if time.monotonic() - self.index_saved_at >= self.INDEX_SAVE_INTERVAL:
+                self._save_index()
+            return path
+    
+    def load(self, key, with_content=True):
+        """Return a process_gcode_content() style result for key, or None on a miss."""
+        path = self.get(key)
+        if path is None:
+            return None
+        with self.lock:
+            entry = dict(self.entries.get(key, {}))
+        content = ''
+        if with_content:
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+            except OSError:
+                return None
+        return {
+            'content': content,
+            'filename': entry.get('filename', os.path.basename(path)),
+            'stats': entry.get('stats', {}),
+            'cached': True
+        }
+    
+    def put(self, key, result):
+        """Store a process_gcode_content() result under key."""
+        data = result['content'].encode('utf-8')
+        if len(data) > self.max_bytes:
+            return
+        
+        def write_output(f):
+            f.write(data)
+            return result
+        self.put_file(key, write_output)
+    
+    def put_file(self, key, write_output):
+        """Create the entry for key by calling write_output(binary_file) and return its result.
+        
+        write_output must return a process_gcode_content() style result; its
+        'content' is not stored. Older entries are then evicted down to the budget.
+        """
+        path = self.path_for(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                result = write_output(f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = {
+                'size': os.path.getsize(path),
+                'filename': result['filename'],
+                'stats': result['stats']
+            }
+            self._evict()
+            self._save_index()
+        return result
+    
+    def materialize(self, cached_path, filepath):
+        """Place a cached file at filepath, hard-linking when possible to avoid a rewrite."""
+        if os.path.exists(filepath) and os.path.samefile(cached_path, filepath):
+            return
+        tmp_path = f"{filepath}.{threading.get_ident()}.tmp"
+        try:
+            os.link(cached_path, tmp_path)
+        except OSError:
+            # Different filesystem or no hard link support
+            shutil.copyfile(cached_path, tmp_path)
+            os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, filepath)
+    
+    def flush(self):
+        """Write index.json if the LRU order changed since it was last saved."""
+        with self.lock:
+            if self.index_dirty:
+                self._save_index()
+    
+    def stats(self):
+        """Return hit/miss counters and current usage."""
+        with self.lock:
+            return {
+                'enabled': True,
+                'entries': len(self.entries),
+                'bytes': sum(entry['size'] for entry in self.entries.values()),
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+    
+    def _evict(self):
+        # The most recent entry is always kept, even if it alone exceeds the budget
+        total = sum(entry['size'] for entry in self.entries.values())
+        while total > self.max_bytes and len(self.entries) > 1:
+            key = next(iter(self.entries))
+            total -= self.entries.pop(key)['size']
+            self.evictions += 1
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+    
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = []
+        for entry in entries:
+            if os.path.exists(self.path_for(entry['key'])):
+                self.entries[entry.pop('key')] = entry
+        with self.lock:
+            self._evict()
+    
+    def _save_index(self):
+        entries = [dict(entry, key=key) for key, entry in self.entries.items()]
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.index_path)
+        self.index_dirty = False
+        self.index_saved_at = time.monotonic()
+
+def content_fingerprint(content):
+    """Return the source fingerprint of G-code content, as stored in the line index."""
+    return hashlib.sha256(content.encode('utf-8') if isinstance(content, str) else content).hexdigest()
+
+def strip_gcode_extension(filename):
+    """Return filename without its (possibly compressed) G-code extension."""
+    lower_name = filename.lower()
+    for extension in sorted(gcode_extensions(), key=len, reverse=True):
+        if lower_name.endswith(extension):
+            return filename[:-len(extension)]
+    return os.path.splitext(filename)[0]
+
+def resume_filename(original_filename, target_z_height, layer_index=None):
+    """Return the resume file name; layers picked by index are numbered, as their Z may repeat."""
+    base_name = strip_gcode_extension(original_filename)
+    if layer_index is not None:
+        return f"{base_name}_resume_layer{layer_index + 1}_Z{target_z_height}mm.gcode"
+    return f"{base_name}_resume_Z{target_z_height}mm.gcode"
+
+def flush_resume_cache():
+    """Persist the resume cache's LRU order before the process exits."""
+    if resume_cache is not None:
+        try:
+            resume_cache.flush()
+        except OSError as e:
+            print(f"Could not save resume cache index: {e}")
+
 def schedule_server_shutdown():
     """Schedule server shutdown in 30 seconds."""
     global shutdown_timer, server_instance
     
+    if not auto_shutdown:
+        return
+    
     # Cancel any existing timer
     if shutdown_timer:
         shutdown_timer.cancel()
@@ -511,6 +1125,7 @@ def schedule_server_shutdown():
             threading.Thread(target=server_instance.shutdown, daemon=True).start()
         
         # Exit the program
+        flush_resume_cache()
         os._exit(0)
     
     # Schedule shutdown in 30 seconds
@@ -524,72 +1139,1016 @@ def schedule_server_shutdown():
     print("🛑 Click 'Terminate Server' button for immediate shutdown")
     print("⏰" * 20 + "\n")
 
+class LayerDetector:
+    """Single-pass layer detection for the common slicer dialects.
+    
+    Lines are fed one at a time and every dialect is tracked at once, so the
+    file never has to be scanned a second time. finish() reports the first
+    dialect, in this order, that found any layers:
+      prusaslicer  ;LAYER_CHANGE followed by ;Z: (PrusaSlicer, OrcaSlicer, Bambu Studio)
+      simplify3d   ; layer <n>, Z = <z>
+      cura         ;LAYER:<n>, with Z taken from the next Z move
+      moves        the Z move before extrusion above the previous layer, once
+                   LAYER_MIN_EXTRUSIONS extruding moves were made at that Z, so
+                   Z-hops, travel lifts, prime lines and wipes are not counted as layers
+    Layer records have a 1-based lineNumber, zHeight, layerChangeComment and
+    zComment, plus byteOffset when feed() is given offsets.
+    """
+    
+    DIALECTS = ('prusaslicer', 'simplify3d', 'cura', 'moves')
+    LAYER_MIN_EXTRUSIONS = 3
+    
+    def __init__(self):
+        self.layers = {dialect: [] for dialect in self.DIALECTS}
+        self.line_number = 0
+        self.pending = []  # LAYER_CHANGE records still waiting for their Z: comment
+        self.cura_pending = None  # ;LAYER:n record waiting for its Z move
+        self.current_z = None
+        self.z_move = None  # (line number, line, offset) of the move that set current_z
+        # As in Klipper's gcode_move, E is relative under G91 or M83; G90 leaves M83 alone
+        self.relative_xyz = False  # G91
+        self.relative_extrude = False  # M83
+        self.relative_e = False
+        self.last_e = 0.0  # Extruder position in absolute mode
+        self.candidate = None  # [z, z_move, extruding moves] of a possible next layer
+    
+    def _record(self, line_number, z_height, marker, z_comment, offset):
+        layer_info = {
+            'lineNumber': line_number,
+            'zHeight': z_height,
+            'layerChangeComment': marker,
+            'zComment': z_comment
+        }
+        if offset is not None:
+            layer_info['byteOffset'] = offset
+        return layer_info
+    
+    def feed(self, line, offset=None):
+        """Process the next (stripped) line; offset is its byte offset in the file.
+        
+        Returns True for lines that may turn out to start a layer (layer
+        comments and Z moves), so callers can snapshot their own state there.
+        """
+        self.line_number += 1
+        line_number = self.line_number
+        
+        if self.pending:
+            z_match = Z_HEIGHT_PATTERN.search(line)
+            still_pending = []
+            for layer_info in self.pending:
+                if z_match:
+                    layer_info['zHeight'] = float(z_match.group(1))
+                    layer_info['zComment'] = line
+                    self.layers['prusaslicer'].append(layer_info)
+                elif line_number - layer_info['lineNumber'] < 4:  # Check next 4 lines
+                    still_pending.append(layer_info)
+            self.pending = still_pending
+        
+        first_char = line[:1]
+        if first_char == ';':
+            if LAYER_CHANGE_PATTERN.search(line):
+                self.pending.append(self._record(line_number, None, line, '', offset))
+                return True
+            s3d_match = S3D_LAYER_PATTERN.match(line)
+            if s3d_match:
+                self.layers['simplify3d'].append(
+                    self._record(line_number, float(s3d_match.group(2)), line, line, offset))
+                return True
+            if CURA_LAYER_PATTERN.match(line):
+                self._finish_cura_layer()
+                self.cura_pending = self._record(line_number, None, line, '', offset)
+                return True
+            return False
+        
+        if first_char not in ('G', 'g'):
+            if first_char in ('M', 'm') and line[1:3] in ('82', '83') and not line[3:4].isdigit():
+                self.relative_extrude = line[2] == '3'
+                self.relative_e = self.relative_xyz or self.relative_extrude
+            return False
+        code = line.split(';', 1)[0] if ';' in line else line
+        command = code[1:3]
+        if command in ('90', '91', '92') and not code[3:4].isdigit():
+            if command != '92':
+                self.relative_xyz = command == '91'
+                self.relative_e = self.relative_xyz or self.relative_extrude
+            else:
+                e_match = EXTRUSION_WORD_PATTERN.search(code)
+                if e_match:
+                    self.last_e = float(e_match.group(1))
+                elif not AXIS_WORD_PATTERN.search(code):
+                    self.last_e = 0.0  # A bare G92 zeroes every axis
+            return False
+        
+        z_move = False
+        if 'Z' in code or 'z' in code:
+            z_match = Z_FALLBACK_PATTERN.search(code)
+            if z_match:
+                self.current_z = float(z_match.group(1))
+                self.z_move = (line_number, line, offset)
+                z_move = True
+                if self.cura_pending is not None:
+                    self.cura_pending['zHeight'] = self.current_z
+                    self.cura_pending['zComment'] = line
+                    self.layers['cura'].append(self.cura_pending)
+                    self.cura_pending = None
+        
+        if not ('E' in code or 'e' in code):
+            return z_move
+        # Extruding moves start a new layer unless they print at or below the last one
+        moves = self.layers['moves']
+        below_floor = self.current_z is None or (moves and self.current_z <= moves[-1]['zHeight'])
+        if below_floor and self.relative_e:
+            return z_move
+        # Absolute E is followed on every move, so retracting wipes do not count as extrusion
+        e_match = EXTRUSION_WORD_PATTERN.search(code)
+        if not e_match:
+            return z_move
+        e_value = float(e_match.group(1))
+        if not self.relative_e:
+            e_value, self.last_e = e_value - self.last_e, e_value
+        if e_value <= 0 or below_floor:
+            return z_move
+        if code[:2] not in ('G1', 'g1') or code[2:3].isdigit():
+            return z_move
+        if not ('X' in code or 'Y' in code or 'x' in code or 'y' in code):
+            return z_move
+        # A short prime line at a high Z would otherwise hide every layer below it
+        if self.candidate is None or self.candidate[0] != self.current_z:
+            self.candidate = [self.current_z, self.z_move, 0]
+        self.candidate[2] += 1
+        if self.candidate[2] == self.LAYER_MIN_EXTRUSIONS:
+            z_line_number, z_line, z_offset = self.candidate[1]
+            moves.append(self._record(z_line_number, self.current_z, z_line, z_line, z_offset))
+        return z_move
+    
+    def _finish_cura_layer(self):
+        # A ;LAYER:n without its own Z move prints at the current height
+        if self.cura_pending is not None and self.current_z is not None:
+            self.cura_pending['zHeight'] = self.current_z
+            self.layers['cura'].append(self.cura_pending)
+        self.cura_pending = None
+    
+    def finish(self):
+        """Return (dialect, layers) for the best dialect found, or (None, [])."""
+        self._finish_cura_layer()
+        self.pending = []
+        for dialect in self.DIALECTS:
+            if self.layers[dialect]:
+                return dialect, self.layers[dialect]
+        return None, []
+
+def detect_layers(lines):
+    """Return (dialect, layers) for a list of G-code lines in a single pass."""
+    detector = LayerDetector()
+    for line in lines:
+        detector.feed(line.strip())
+    dialect, layers = detector.finish()
+    print(f"Layer analysis complete. Found {len(layers)} layers ({dialect or 'no layers'}).")
+    return dialect, layers
+
 def find_layer_changes(content):
-    """Find all LAYER_CHANGE comments with Z heights."""
-    layer_lines = []
+    """Find all layer changes with Z heights, whichever slicer wrote the file."""
     lines = content.split('\n') if isinstance(content, str) else content
+    return detect_layers(lines)[1]
+
+def _open_zstd(fileobj):
+    """Open a zstd stream with the stdlib module (Python 3.14+) or the zstandard package."""
+    try:
+        from compression import zstd
+        return zstd.ZstdFile(fileobj, 'rb')
+    except ImportError:
+        pass
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError("Reading .zst files requires Python 3.14+ or the 'zstandard' package")
+    # stream_reader() has no readline()/iteration, so buffer it like the .bgcode reader
+    reader = zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=True)
+    return io.BufferedReader(reader, buffer_size=1024 * 1024)
+
+def heatshrink_decompress(data, window_bits, lookahead_bits):
+    """Decompress a heatshrink (LZSS) stream as used by binary G-code blocks."""
+    output = bytearray()
+    padded = bytes(data) + b'\x00\x00\x00'
+    total_bits = len(data) * 8
+    pos = 0
     
-    # Patterns to match LAYER_CHANGE and Z: comments
-    layer_change_pattern = re.compile(r';\s*LAYER_CHANGE', re.IGNORECASE)
-    z_height_pattern = re.compile(r';\s*Z:\s*(\d+\.?\d*)', re.IGNORECASE)
+    def read_bits(count):
+        nonlocal pos
+        if pos + count > total_bits:
+            return None
+        i = pos >> 3
+        chunk = (padded[i] << 16) | (padded[i + 1] << 8) | padded[i + 2]
+        value = (chunk >> (24 - (pos & 7) - count)) & ((1 << count) - 1)
+        pos += count
+        return value
+    
+    while True:
+        tag = read_bits(1)
+        if tag is None:
+            break
+        if tag:
+            literal = read_bits(8)
+            if literal is None:
+                break
+            output.append(literal)
+            continue
+        index = read_bits(window_bits)
+        if index is None:
+            break
+        count = read_bits(lookahead_bits)
+        if count is None:
+            break
+        start = len(output) - (index + 1)
+        for i in range(count + 1):
+            output.append(output[start + i])
     
-    for i, line in enumerate(lines):
-        line = line.strip()
+    return bytes(output)
+
+# MeatPack packs common G-code characters into nibbles (binary G-code encoding 1/2)
+MEATPACK_SIGNAL = 0xFF
+MEATPACK_ENABLE_PACKING = 251
+MEATPACK_DISABLE_PACKING = 250
+MEATPACK_RESET_ALL = 249
+MEATPACK_ENABLE_NO_SPACES = 247
+MEATPACK_DISABLE_NO_SPACES = 246
+MEATPACK_CHARS = b'0123456789. \nGX'
+MEATPACK_G_PARAMETERS = b'XYZEFIJRPWHCA'
+
+def meatpack_decode(data):
+    """Decode a MeatPack stream, re-inserting the spaces removed from G lines."""
+    chars = bytearray()
+    packing = False
+    no_spaces = False
+    signal_count = 0
+    command_pending = False
+    full_char_queue = 0
+    char_buf = 0
+    
+    def unpack(nibble):
+        if nibble == 0b1011 and no_spaces:
+            return ord('E')
+        return MEATPACK_CHARS[nibble]
+    
+    def handle_byte(c):
+        nonlocal full_char_queue, char_buf
+        if not packing:
+            chars.append(c)
+        elif full_char_queue > 0:
+            chars.append(c)
+            if char_buf:
+                chars.append(char_buf)
+                char_buf = 0
+            full_char_queue -= 1
+        else:
+            low, high = c & 0xF, c >> 4
+            if low == 0xF:
+                full_char_queue += 1
+                if high == 0xF:
+                    full_char_queue += 1
+                else:
+                    char_buf = unpack(high)
+            else:
+                first = unpack(low)
+                chars.append(first)
+                if first != ord('\n'):
+                    if high == 0xF:
+                        full_char_queue += 1
+                    else:
+                        chars.append(unpack(high))
+    
+    for c in data:
+        if c == MEATPACK_SIGNAL:
+            if signal_count > 0:
+                command_pending = True
+                signal_count = 0
+            else:
+                signal_count += 1
+        elif command_pending:
+            if c == MEATPACK_ENABLE_PACKING:
+                packing = True
+            elif c in (MEATPACK_DISABLE_PACKING, MEATPACK_RESET_ALL):
+                packing = False
+            elif c == MEATPACK_ENABLE_NO_SPACES:
+                no_spaces = True
+            elif c == MEATPACK_DISABLE_NO_SPACES:
+                no_spaces = False
+            command_pending = False
+        else:
+            if signal_count > 0:
+                handle_byte(MEATPACK_SIGNAL)
+                signal_count = 0
+            handle_byte(c)
+    
+    # G lines lose the spaces between parameters when packed without spaces
+    output = bytearray()
+    add_space = False
+    for c in chars:
+        if c == ord('G') and (not output or output[-1] == ord('\n')):
+            add_space = True
+        elif c == ord('\n'):
+            add_space = False
+        if add_space and (not output or output[-1] != ord(' ')) and c in MEATPACK_G_PARAMETERS:
+            output.append(ord(' '))
+        if c != ord('\n') or not output or output[-1] != ord('\n'):
+            output.append(c)
+    return bytes(output)
+
+class BgcodeReader(io.RawIOBase):
+    """Read-only stream of the G-code text stored in a binary G-code (.bgcode) file.
+    
+    Blocks are decoded one at a time, so only a single G-code block is held in
+    memory. Metadata and thumbnail blocks are skipped.
+    """
+    
+    MAGIC = b'GCDE'
+    BLOCK_GCODE = 1
+    BLOCK_THUMBNAIL = 5
+    HEATSHRINK_PARAMS = {2: (11, 4), 3: (12, 4)}
+    
+    def __init__(self, fileobj):
+        super().__init__()
+        self.fileobj = fileobj
+        magic, _version, checksum_type = struct.unpack('<4sIH', self._read_exact(10))
+        if magic != self.MAGIC:
+            raise ValueError("Not a binary G-code file")
+        self.checksum_size = 4 if checksum_type == 1 else 0
+        self.buffer = b''
+        self.buffer_pos = 0
+    
+    def _read_exact(self, size):
+        data = self.fileobj.read(size)
+        if len(data) != size:
+            raise ValueError("Truncated binary G-code file")
+        return data
+    
+    def _next_gcode_block(self):
+        """Return the decoded text of the next G-code block, or None at end of file."""
+        while True:
+            header = self.fileobj.read(8)
+            if not header:
+                return None
+            if len(header) != 8:
+                raise ValueError("Truncated binary G-code file")
+            block_type, compression, uncompressed_size = struct.unpack('<HHI', header)
+            size = uncompressed_size
+            if compression:
+                size = struct.unpack('<I', self._read_exact(4))[0]
+            params = self._read_exact(6 if block_type == self.BLOCK_THUMBNAIL else 2)
+            
+            if block_type != self.BLOCK_GCODE:
+                self.fileobj.seek(size + self.checksum_size, os.SEEK_CUR)
+                continue
+            
+            data = self._read_exact(size)
+            self.fileobj.seek(self.checksum_size, os.SEEK_CUR)
+            if compression == 1:
+                data = zlib.decompress(data)
+            elif compression in self.HEATSHRINK_PARAMS:
+                data = heatshrink_decompress(data, *self.HEATSHRINK_PARAMS[compression])
+            elif compression:
+                raise ValueError(f"Unsupported binary G-code compression: {compression}")
+            
+            encoding = struct.unpack('<H', params)[0]
+            if encoding in (1, 2):
+                data = meatpack_decode(data)
+            elif encoding:
+                raise ValueError(f"Unsupported binary G-code encoding: {encoding}")
+            return data
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        while self.buffer_pos >= len(self.buffer):
+            block = self._next_gcode_block()
+            if block is None:
+                return 0
+            self.buffer = block
+            self.buffer_pos = 0
+        count = min(len(b), len(self.buffer) - self.buffer_pos)
+        b[:count] = self.buffer[self.buffer_pos:self.buffer_pos + count]
+        self.buffer_pos += count
+        return count
+    
+    def close(self):
+        self.fileobj.close()
+        super().close()
+
+# Stream decoders by file suffix; see register_gcode_codec()
+GCODE_CODECS = {
+    '.gz': lambda fileobj: gzip.GzipFile(fileobj=fileobj, mode='rb'),
+    '.zst': _open_zstd,
+    '.bgcode': lambda fileobj: io.BufferedReader(BgcodeReader(fileobj), buffer_size=1024 * 1024)
+}
+
+def register_gcode_codec(suffix, opener):
+    """Register opener(binary_file) -> readable binary stream of G-code text for a suffix.
+    
+    Compression suffixes such as '.xz' are accepted after '.gcode'; suffixes
+    ending in 'gcode' (like '.bgcode') are accepted as complete extensions.
+    """
+    GCODE_CODECS[suffix.lower()] = opener
+
+def gcode_extensions():
+    """Return the accepted file extensions: plain G-code plus one per registered codec."""
+    extensions = list(PLAIN_GCODE_EXTENSIONS)
+    for suffix in GCODE_CODECS:
+        extensions.append(suffix if suffix.endswith('gcode') else '.gcode' + suffix)
+    return tuple(extensions)
+
+def is_gcode_file(filepath):
+    """Return True for plain, compressed and binary G-code files."""
+    return filepath.lower().endswith(gcode_extensions())
+
+def open_gcode_stream(filepath):
+    """Open a G-code file as a binary stream of decoded G-code text.
+    
+    Compressed and binary files are decoded on the fly, never inflated to disk.
+    Byte offsets in the line index refer to positions in this decoded stream.
+    """
+    fileobj = open(filepath, 'rb')
+    for suffix, opener in GCODE_CODECS.items():
+        if filepath.lower().endswith(suffix):
+            try:
+                return opener(fileobj)
+            except Exception:
+                fileobj.close()
+                raise
+    return fileobj
+
+def seek_stream(f, offset):
+    """Seek a decoded stream, reading forward when it does not support seeking."""
+    if f.seekable():
+        f.seek(offset)
+        return
+    remaining = offset
+    while remaining > 0:
+        chunk = f.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+
+def build_line_index(filepath, step=LINE_INDEX_STEP, printer_cfg_path=None):
+    """Stream a G-code file once, recording layer changes and a sparse line-offset index.
+    
+    checkpoints[k] is the byte offset of line k * step + 1 (1-based line numbers).
+    Layer records come from LayerDetector, with the byte offset of each layer's first line.
+    The index also records everything process_gcode_file() needs to rewrite the
+    file in a single streaming pass (0-based line numbers, like process_gcode_content).
+    """
+    checkpoints = []
+    detector = LayerDetector()
+    estimator = LayerEstimator(read_printer_limits(printer_cfg_path)) if np is not None else None
+    filament_start = None
+    g28_lines = array('l')
+    z_move_lines = array('l')
+    exec_block_ends = array('l')
+    in_exec_block = False
+    crlf = False
+    fingerprint = hashlib.sha256()
+    offset = 0
+    line_number = 0
+    raw_line = b''
+    
+    with open_gcode_stream(filepath) as f:
+        for raw_line in f:
+            if line_number % step == 0:
+                checkpoints.append(offset)
+            line_index = line_number
+            line_number += 1
+            fingerprint.update(raw_line)
+            line = raw_line.decode('utf-8', errors='ignore').strip()
+            if detector.feed(line, offset) and estimator is not None:
+                estimator.mark(line_number)
+            
+            first_char = line[:1]
+            if first_char in ('G', 'g'):
+                if G28_PATTERN.match(line):
+                    g28_lines.append(line_index)
+                elif Z_MOVE_PATTERN.match(line):
+                    z_move_lines.append(line_index)
+            
+            if estimator is not None and first_char in ('G', 'g', 'M', 'm'):
+                estimator.add_line(line)
+            
+            if ';' in line:
+                if filament_start is None and FILAMENT_START_MARKER in line:
+                    filament_start = line_index
+                # Executable blocks pair up like find_executable_blocks()
+                if in_exec_block:
+                    if EXEC_BLOCK_END_PATTERN.search(line):
+                        exec_block_ends.append(line_index)
+                        in_exec_block = False
+                elif EXEC_BLOCK_START_PATTERN.search(line):
+                    in_exec_block = True
+            
+            if raw_line.endswith(b'\r\n'):
+                crlf = True
+            offset += len(raw_line)
+    
+    # A trailing newline still counts as an (empty) last line, like str.split('\n')
+    if line_number % step == 0:
+        checkpoints.append(offset)
+    total_lines = line_number + 1 if offset == 0 or raw_line.endswith(b'\n') else line_number
+    
+    dialect, layers = detector.finish()
+    layer_states = None
+    if estimator is not None and layers:
+        layer_states = estimator.finish(layers)
+    
+    print(f"Layer analysis complete. Found {len(layers)} layers ({dialect or 'no layers'}).")
+    return {
+        'layers': layers,
+        'dialect': dialect,
+        'layer_states': layer_states,
+        'checkpoints': checkpoints,
+        'step': step,
+        'total_lines': total_lines,
+        'filament_start': filament_start,
+        'g28_lines': g28_lines,
+        'z_move_lines': z_move_lines,
+        'exec_block_ends': exec_block_ends,
+        'crlf': crlf,
+        'fingerprint': fingerprint.hexdigest()
+    }
+
+def get_line_index(filepath, printer_cfg_path=None):
+    """Return the cached line index for a file, rebuilding it if the file changed.
+    
+    Files inside a printer root use that root's cache and printer.cfg, and are
+    built as a job of that root on the job scheduler. Concurrent requests for
+    the same file wait for the build already in flight instead of repeating it.
+    printer_cfg_path overrides the printer.cfg used for print-time estimates,
+    e.g. for the Klipper module, whose files are usually outside any root.
+    """
+    root = find_printer_root(os.path.abspath(filepath))
+    if root is not None:
+        cache, lock, building = root.line_index_cache, root.line_index_lock, root.line_index_building
+        printer_cfg_path = printer_cfg_path or root.printer_cfg_path
+    else:
+        cache, lock, building = line_index_cache, line_index_lock, line_index_building
+    file_stat = os.stat(filepath)
+    key = (file_stat.st_size, file_stat.st_mtime_ns, printer_cfg_path)
+    scheduled = job_scheduler is not None and root is not None
+    
+    while True:
+        with lock:
+            cached = cache.get(filepath)
+            if cached and cached['key'] == key:
+                return cached
+            in_flight = building.get(filepath)
+            if in_flight is None:
+                in_flight = building[filepath] = threading.Event()
+                break
+        if scheduled and job_scheduler.in_job():
+            # Waiting here could hold the worker the other build needs
+            in_flight = None
+            break
+        in_flight.wait()
+    
+    try:
+        with job_scheduler.job(root) if scheduled else nullcontext():
+            index = build_line_index(filepath, printer_cfg_path=printer_cfg_path)
+        index['key'] = key
+        with lock:
+            cache[filepath] = index
+        return index
+    finally:
+        if in_flight is not None:
+            with lock:
+                del building[filepath]
+            in_flight.set()
+
+def read_line_window(filepath, index, start, end):
+    """Return lines [start, end) (1-based) by seeking to the nearest checkpoint."""
+    if end <= start:
+        return []
+    
+    step = index['step']
+    checkpoint = min((start - 1) // step, len(index['checkpoints']) - 1)
+    line_number = checkpoint * step + 1
+    lines = []
+    
+    with open_gcode_stream(filepath) as f:
+        seek_stream(f, index['checkpoints'][checkpoint])
+        for raw_line in f:
+            if line_number >= end:
+                break
+            if line_number >= start:
+                lines.append(raw_line.decode('utf-8', errors='ignore').rstrip('\r\n'))
+            line_number += 1
+    
+    # The empty line after a trailing newline is not returned by file iteration
+    if line_number < end and line_number == index['total_lines'] and line_number >= start:
+        lines.append('')
+    
+    return lines
+
+class MoveColumns:
+    """Row store of G0/G1 moves and G92 resets collected while streaming a file.
+    
+    Each row is X, Y, Z, E and F as float32, with absent axis words stored as
+    NaN so the modal state can be resolved afterwards with numpy. A flag byte
+    per row marks G92 resets and the G91 and M83 modes in effect; as in
+    Klipper's gcode_move, E is relative when either is active.
+    """
+    
+    AXES = 'XYZEF'
+    ROW_WIDTH = 5
+    AXIS_INDEX = {axis: i for i, axis in enumerate(AXES + AXES.lower())}
+    RESET = 1
+    RELATIVE_XYZ = 2
+    RELATIVE_E = 4
+    
+    def __init__(self, relative_xyz=False, relative_e=False):
+        self.rows = array('f')
+        self.flags = array('B')
+        self.modes = (self.RELATIVE_XYZ if relative_xyz else 0) | (self.RELATIVE_E if relative_e else 0)
+    
+    def add_line(self, line):
+        """Record a motion-related command; other lines are ignored."""
+        match = MOTION_COMMAND_PATTERN.match(line)
+        if not match:
+            return
+        command = match.group(1).upper()
         
-        # Look for LAYER_CHANGE comment
-        if layer_change_pattern.search(line):
-            # Look for Z: comment in the next few lines
-            for j in range(i + 1, min(i + 5, len(lines))):  # Check next 4 lines
-                next_line = lines[j].strip()
-                z_match = z_height_pattern.search(next_line)
-                
-                if z_match:
-                    z_height = float(z_match.group(1))
-                    layer_info = {
-                        'lineNumber': i + 1,  # Line number where LAYER_CHANGE starts
-                        'zHeight': z_height,
-                        'layerChangeComment': line,
-                        'zComment': next_line
-                    }
-                    layer_lines.append(layer_info)
-                    break
+        if command in ('G0', 'G1', 'G92'):
+            row = [math.nan] * 5
+            code = line.split(';', 1)[0]
+            words = AXIS_WORD_PATTERN.findall(code, match.end())
+            if words:
+                axis_index = self.AXIS_INDEX
+                for axis, value in words:
+                    row[axis_index[axis] % 5] = float(value)
+            elif command == 'G92':
+                row[0:4] = [0.0, 0.0, 0.0, 0.0]
+            self.rows.extend(row)
+            self.flags.append(self.modes | (self.RESET if command == 'G92' else 0))
+        elif command == 'G90':
+            self.modes &= ~self.RELATIVE_XYZ
+        elif command == 'G91':
+            self.modes |= self.RELATIVE_XYZ
+        elif command == 'M82':
+            self.modes &= ~self.RELATIVE_E
+        elif command == 'M83':
+            self.modes |= self.RELATIVE_E
     
-    print(f"Layer analysis complete. Found {len(layer_lines)} layers.")
-    return layer_lines
+    def as_arrays(self):
+        """Return (matrix, is_reset, relative_xyz, relative_e) with an (n, 5) float64 matrix."""
+        matrix = np.frombuffer(self.rows, dtype=np.float32).reshape(-1, self.ROW_WIDTH).astype(np.float64)
+        flags = np.frombuffer(self.flags, dtype=np.uint8)
+        return (matrix, (flags & self.RESET) != 0, (flags & self.RELATIVE_XYZ) != 0,
+                (flags & (self.RELATIVE_XYZ | self.RELATIVE_E)) != 0)
+    
+    def clear(self):
+        """Drop the stored rows, keeping the current modes."""
+        self.rows = array('f')
+        self.flags = array('B')
+    
+    def __len__(self):
+        return len(self.flags)
 
-def find_layer_lines(content):
-    """Find all lines that contain layer height information (Z moves) - LEGACY FALLBACK."""
-    layer_lines = []
-    z_pattern = re.compile(r'G[01]\s+.*Z(\d+\.?\d*)', re.IGNORECASE)
+def _resolve_axis(values, relative, is_reset, initial=0.0):
+    """Turn raw axis words into absolute positions after every row.
     
-    for i, line in enumerate(content):
-        match = z_pattern.search(line)
-        if match:
-            z_height = float(match.group(1))
-            layer_lines.append((i, z_height, line.strip()))
+    Absolute words and G92 resets are anchors; relative words accumulate onto
+    the most recent anchor.
+    """
+    present = ~np.isnan(values)
+    anchor = present & (~relative | is_reset)
+    deltas = np.where(present & ~anchor, values, 0.0)
+    cumulative = np.cumsum(deltas)
+    
+    rows = np.arange(len(values))
+    last_anchor = np.maximum.accumulate(np.where(anchor, rows, -1))
+    safe_anchor = np.maximum(last_anchor, 0)
+    base = np.where(last_anchor >= 0, values[safe_anchor] - cumulative[safe_anchor], initial)
+    return base + cumulative
+
+def read_printer_limits(config_path=None):
+    """Read velocity/accel limits and filament diameter from printer.cfg."""
+    if config_path is None:
+        config_path = PRINTER_CFG_PATH
+    limits = dict(DEFAULT_PRINTER_LIMITS)
+    sections = {'printer', 'extruder'}
+    section = None
+    
+    try:
+        with open(config_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                if line[:1].isspace():
+                    continue  # Continuation lines (macro bodies etc.)
+                line = line.split('#', 1)[0].strip()
+                if line.startswith('[') and line.endswith(']'):
+                    section = line[1:-1].strip()
+                    continue
+                if section not in sections or ':' not in line:
+                    continue
+                key, value = [part.strip() for part in line.split(':', 1)]
+                if key in limits:
+                    try:
+                        limits[key] = float(value)
+                    except ValueError:
+                        pass
+    except OSError as e:
+        print(f"Could not read printer limits from {config_path}: {e}")
+    
+    return limits
+
+def _trapezoid_times(distance, velocity, accel, start_v, end_v):
+    """Return move durations for trapezoidal profiles between the given start and end speeds."""
+    peak_v2 = np.minimum(velocity ** 2, accel * distance + 0.5 * (start_v ** 2 + end_v ** 2))
+    # A move too short to change speed as planned (look-ahead would have lowered a junction)
+    too_short = peak_v2 < np.maximum(start_v, end_v) ** 2
+    peak_v2 = np.maximum(peak_v2, np.maximum(start_v, end_v) ** 2)
+    peak = np.sqrt(peak_v2)
+    # Zero up to rounding when the move never cruises, so it is clamped, not tested
+    cruise_distance = distance - (2.0 * peak_v2 - start_v ** 2 - end_v ** 2) / (2.0 * accel)
+    ramp_time = (2.0 * peak - start_v - end_v) / accel + np.maximum(cruise_distance, 0.0) / peak
+    with np.errstate(divide='ignore', invalid='ignore'):
+        constant_accel_time = 2.0 * distance / (start_v + end_v)
+    return np.where(too_short, constant_accel_time, ramp_time)
+
+def _junction_speeds(unit, kinematic, travel, velocity, accel, junction_deviation):
+    """Return the speeds between consecutive moves as in Klipper's toolhead.Move.calc_junction().
+    
+    unit holds the moves' XYZ unit vectors. Computed in place where possible,
+    as this runs on whole estimator chunks.
+    """
+    # -cos(theta), where theta is the angle between the moves as Klipper measures it
+    dot = np.einsum('ij,ij->i', unit[1:], unit[:-1])
+    np.clip(dot, -1.0, 1.0, out=dot)
+    corner = dot < 1.0  # Straight continuations are unlimited
+    sin_theta_d2 = np.sqrt(0.5 * (1.0 + dot))
+    np.multiply(dot, -0.5, out=dot)
+    dot += 0.5
+    cos_theta_d2 = np.sqrt(dot, out=dot)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        limit_v2 = sin_theta_d2 / (1.0 - sin_theta_d2)
+        limit_v2 *= junction_deviation * np.minimum(accel[1:], accel[:-1])
+        # The approximated circle must touch both moves no further than their midpoints
+        centripetal_v2 = travel * accel
+        centripetal_v2 = np.minimum(centripetal_v2[1:], centripetal_v2[:-1])
+        centripetal_v2 *= sin_theta_d2
+        centripetal_v2 /= cos_theta_d2
+        centripetal_v2 *= 0.5
+    np.minimum(limit_v2, centripetal_v2, out=limit_v2)
     
-    return layer_lines
+    junction_v2 = np.minimum(velocity[1:], velocity[:-1])
+    junction_v2 **= 2
+    np.minimum(junction_v2, limit_v2, out=junction_v2, where=corner)
+    # Extrude-only moves start and end at rest
+    junction_v2[~(kinematic[1:] & kinematic[:-1])] = 0.0
+    return np.sqrt(junction_v2, out=junction_v2)
+
+class LayerEstimator:
+    """Per-layer move length, extrusion and time estimates accumulated while streaming.
+    
+    Moves are buffered in MoveColumns chunks of CHUNK_ROWS rows and reduced with
+    numpy as each chunk fills, so memory stays flat however long the file is.
+    mark() is called before the moves of any line that may start a layer and
+    snapshots the running totals and machine state there; finish() turns the
+    marks at the detected layer starts into per-layer figures.
+    
+    Times use a trapezoidal profile per move, with Klipper's Z velocity/accel
+    scaling for moves with a Z component. Speeds at the junctions between moves
+    follow Klipper's junction deviation model, so shallow angles (curves) keep
+    their speed and only real corners slow down towards square_corner_velocity.
+    Klipper's look-ahead over several short moves is not modelled.
+    """
+    
+    CHUNK_ROWS = 65536
+    # Running distance, net extrusion and time, then X, Y, Z, E and the G91 and M83 modes
+    MARK_WIDTH = 9
+    
+    def __init__(self, limits):
+        self.limits = limits
+        self.moves = MoveColumns()
+        self.previous = None  # X, Y, Z, E, F after the last flushed row
+        # Unit vector, whether it moves XYZ, length, speed, accel, start speed and
+        # stop-at-end time of the last flushed move, whose end speed is only known
+        # once the next move arrives
+        self.last_move = None
+        self.junction_deviation = (limits['square_corner_velocity'] ** 2 * (math.sqrt(2.0) - 1.0)
+                                   / limits['max_accel'])
+        self.totals = [0.0, 0.0, 0.0]
+        self.mark_lines = array('l')
+        self.marks = array('d')
+        self.pending = []  # (row in the current chunk, modes) for marks not yet flushed
+    
+    def mark(self, line_number):
+        """Snapshot the state before the moves of a line that may start a layer."""
+        self.mark_lines.append(line_number)
+        self.pending.append((len(self.moves), self.moves.modes))
+    
+    def add_line(self, line):
+        """Record a motion-related command, reducing the buffered chunk once it is full."""
+        self.moves.add_line(line)
+        if len(self.moves) >= self.CHUNK_ROWS:
+            self._flush()
+    
+    def _flush(self):
+        limits = self.limits
+        count = len(self.moves)
+        if count:
+            matrix, is_reset, relative_xyz, relative_e = self.moves.as_arrays()
+            if self.previous is None:
+                initial = [0.0, 0.0, 0.0, 0.0, limits['max_velocity'] * 60.0]
+            else:
+                initial = self.previous
+            no_flags = np.zeros(count, dtype=bool)
+            resolved = np.column_stack(
+                [_resolve_axis(matrix[:, i], relative_xyz, is_reset, initial[i]) for i in range(3)]
+                + [_resolve_axis(matrix[:, 3], relative_e, is_reset, initial[3]),
+                   _resolve_axis(matrix[:, 4], no_flags, no_flags, initial[4])])
+            # The very first move has no known start, so it does not count
+            start = resolved[0] if self.previous is None else np.array(initial)
+            deltas = np.diff(resolved[:, :4], axis=0, prepend=start[np.newaxis, :4])
+            deltas[is_reset] = 0.0
+            dx, dy, dz, de = deltas.T
+            
+            distance = np.sqrt(dx * dx + dy * dy + dz * dz)
+            # Extrude-only moves are timed by their filament length
+            travel = np.where(distance > 0.0, distance, np.abs(de))
+            
+            velocity = np.minimum(resolved[:, 4] / 60.0, limits['max_velocity'])
+            accel = np.full(count, limits['max_accel'])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                z_ratio = np.where(dz != 0.0, distance / np.abs(dz), np.inf)
+            velocity = np.minimum(velocity, limits['max_z_velocity'] * z_ratio)
+            accel = np.minimum(accel, limits['max_z_accel'] * z_ratio)
+            velocity = np.maximum(velocity, 1e-3)
+            
+            # Rows without motion (feedrate changes, G92) are not moves and do not break junctions
+            moving = ~is_reset & (travel > 0.0)
+            move_time = np.zeros(count)
+            if moving.any():
+                move_time[moving] = self._move_times(deltas[moving, :3], distance[moving], travel[moving],
+                                                     velocity[moving], accel[moving])
+            
+            # Running totals before each row, plus one past the end of the chunk
+            running = np.zeros((count + 1, 3))
+            np.cumsum(np.column_stack((distance, de, move_time)), axis=0, out=running[1:])
+            running += self.totals
+        
+        for row, modes in self.pending:
+            if row == 0:
+                totals = self.totals
+                state = self.previous[:4] if self.previous is not None else [0.0, 0.0, 0.0, 0.0]
+            else:
+                totals = running[row]
+                state = resolved[row - 1, :4]
+            self.marks.extend(totals)
+            self.marks.extend(state)
+            self.marks.extend([float(bool(modes & MoveColumns.RELATIVE_XYZ)),
+                               float(bool(modes & MoveColumns.RELATIVE_E))])
+        self.pending = []
+        
+        if count:
+            self.totals = [float(value) for value in running[-1]]
+            self.previous = [float(value) for value in resolved[-1]]
+            self.moves.clear()
+    
+    def _move_times(self, deltas, distance, travel, velocity, accel):
+        """Return the duration of consecutive moves, given their XYZ deltas, lengths and limits."""
+        kinematic = distance > 0.0
+        unit = deltas / np.where(kinematic, distance, 1.0)[:, np.newaxis]
+        previous = self.last_move
+        if previous is not None:
+            unit = np.vstack((previous[0], unit))
+            kinematic = np.concatenate(([previous[1]], kinematic))
+            travel, velocity, accel = [np.concatenate(([value], column)) for value, column
+                                       in zip(previous[2:5], (travel, velocity, accel))]
+        last_unit = unit[-1].copy()
+        junction = _junction_speeds(unit, kinematic, travel, velocity, accel, self.junction_deviation)
+        unit = None  # Only needed for the junctions; keeps the chunk's peak memory down
+        
+        start_v = np.concatenate(([previous[5] if previous is not None else 0.0], junction))
+        end_v = np.concatenate((junction, [0.0]))
+        times = _trapezoid_times(travel, velocity, accel, start_v, end_v)
+        self.last_move = (last_unit, kinematic[-1], travel[-1], velocity[-1], accel[-1],
+                          start_v[-1], times[-1])
+        if previous is not None:
+            # The previous chunk's last move was timed as if it stopped; correct it here
+            times[1] += times[0] - previous[6]
+            times = times[1:]
+        return times
+    
+    def finish(self, layers):
+        """Attach estimates to the layer records and return their (n_layers, 6) start states.
+        
+        A start state is X, Y, Z, E and the G91 and M83 modes after the last
+        move before the layer's first line, which lets a single layer be decoded
+        on its own (see extract_layer_toolpath).
+        """
+        self._flush()
+        marks = np.frombuffer(self.marks, dtype=np.float64).reshape(-1, self.MARK_WIDTH)
+        layer_starts = np.array([layer_info['lineNumber'] for layer_info in layers])
+        rows = np.searchsorted(np.frombuffer(self.mark_lines, dtype=np.dtype('l')), layer_starts)
+        at_start = marks[rows]
+        
+        # Moves before the first layer start are not part of any layer
+        per_layer = np.diff(np.vstack((at_start[:, :3], [self.totals])), axis=0)
+        move_length = per_layer[:, 0]
+        # Net filament, so retract/unretract pairs cancel out
+        extrusion = np.maximum(per_layer[:, 1], 0.0)
+        layer_time = per_layer[:, 2]
+        
+        filament_area = math.pi * (self.limits['filament_diameter'] / 2.0) ** 2
+        grams_per_mm = filament_area / 1000.0 * FILAMENT_DENSITY
+        remaining_time = np.cumsum(layer_time[::-1])[::-1]
+        remaining_extrusion = np.cumsum(extrusion[::-1])[::-1]
+        
+        for i, layer_info in enumerate(layers):
+            layer_info['moveLength'] = round(float(move_length[i]), 2)
+            layer_info['extrusion'] = round(float(extrusion[i]), 3)
+            layer_info['timeEstimate'] = round(float(layer_time[i]), 2)
+            layer_info['remainingTime'] = round(float(remaining_time[i]), 1)
+            layer_info['remainingFilament'] = round(float(remaining_extrusion[i] * grams_per_mm), 2)
+        
+        return at_start[:, 3:].copy()
+
+# Segment kinds in the last column of a toolpath preview
+TOOLPATH_TRAVEL = 0.0
+TOOLPATH_EXTRUDE = 1.0
+TOOLPATH_PREVIOUS = 2.0
+
+def extract_layer_toolpath(filepath, index, layer_number):
+    """Return the XY segments of one layer as a float32 (n, 5) array: x0, y0, x1, y1, kind.
+    
+    Only the layer's own byte span is read, starting from its indexed byte
+    offset and the machine state recorded for its first line. Moves without
+    XY motion (Z-hops, retracts) are dropped.
+    """
+    layers = index['layers']
+    state = index['layer_states'][layer_number]
+    start = layers[layer_number]['byteOffset']
+    end = layers[layer_number + 1]['byteOffset'] if layer_number + 1 < len(layers) else None
+    
+    moves = MoveColumns(relative_xyz=state[4], relative_e=state[5])
+    offset = start
+    with open_gcode_stream(filepath) as f:
+        seek_stream(f, start)
+        for raw_line in f:
+            if end is not None and offset >= end:
+                break
+            offset += len(raw_line)
+            if raw_line[:1] in (b'G', b'g', b'M', b'm'):
+                moves.add_line(raw_line.decode('utf-8', errors='ignore').strip())
+    
+    if not len(moves):
+        return np.zeros((0, 5), dtype='<f4')
+    
+    matrix, is_reset, relative_xyz, relative_e = moves.as_arrays()
+    x = _resolve_axis(matrix[:, 0], relative_xyz, is_reset, state[0])
+    y = _resolve_axis(matrix[:, 1], relative_xyz, is_reset, state[1])
+    e = _resolve_axis(matrix[:, 3], relative_e, is_reset, state[3])
+    
+    x0 = np.concatenate(([state[0]], x[:-1]))
+    y0 = np.concatenate(([state[1]], y[:-1]))
+    de = np.diff(e, prepend=state[3])
+    kind = np.where(de > 0.0, TOOLPATH_EXTRUDE, TOOLPATH_TRAVEL)
+    
+    moving = ~is_reset & ((x != x0) | (y != y0))
+    return np.column_stack((x0, y0, x, y, kind))[moving].astype('<f4')
+
+def get_layer_toolpath(filepath, index, layer_number):
+    """Return the cached toolpath of a layer, extracting it on a miss."""
+    key = (filepath, index['key'], layer_number)
+    with toolpath_cache_lock:
+        segments = toolpath_cache.get(key)
+        if segments is not None:
+            toolpath_cache.move_to_end(key)
+            return segments
+    
+    segments = extract_layer_toolpath(filepath, index, layer_number)
+    segments.flags.writeable = False  # Shared between requests
+    with toolpath_cache_lock:
+        toolpath_cache[key] = segments
+        while len(toolpath_cache) > TOOLPATH_CACHE_ENTRIES:
+            toolpath_cache.popitem(last=False)
+    return segments
 
 def find_filament_gcode_start(content):
     """Find the first occurrence of '; Filament gcode'."""
     for i, line in enumerate(content):
-        if '; Filament gcode' in line:
+        if FILAMENT_START_MARKER in line:
             return i
     return None
 
 def find_executable_blocks(content):
     """Find all EXECUTABLE_BLOCK_START and EXECUTABLE_BLOCK_END sections."""
     blocks = []
-    start_pattern = re.compile(r';\s*EXECUTABLE_BLOCK_START', re.IGNORECASE)
-    end_pattern = re.compile(r';\s*EXECUTABLE_BLOCK_END', re.IGNORECASE)
     
     i = 0
     while i < len(content):
-        if start_pattern.search(content[i]):
+        if EXEC_BLOCK_START_PATTERN.search(content[i]):
             start_line = i
             j = i + 1
             while j < len(content):
-                if end_pattern.search(content[j]):
+                if EXEC_BLOCK_END_PATTERN.search(content[j]):
                     blocks.append((start_line, j))
                     break
                 j += 1
@@ -602,7 +2161,6 @@ def find_executable_blocks(content):
 def comment_out_all_z_moves_before_target(content, target_line):
     """Comment out ALL Z moves (including in executable blocks) BEFORE the target line."""
     modified_content = content[:]
-    z_move_pattern = re.compile(r'^\s*G[01]\s+.*Z', re.IGNORECASE)
     z_moves_commented = 0
     
     # Comment out all Z moves before target line, regardless of context
@@ -611,7 +2169,7 @@ def comment_out_all_z_moves_before_target(content, target_line):
             break
             
         line = modified_content[i]
-        if z_move_pattern.match(line.strip()) and not line.strip().startswith(';'):
+        if Z_MOVE_PATTERN.match(line.strip()) and not line.strip().startswith(';'):
             modified_content[i] = '; REMOVED Z-MOVE: ' + line
             z_moves_commented += 1
     
@@ -624,11 +2182,10 @@ def comment_out_all_z_moves_before_target(content, target_line):
 def remove_g28_commands_before_target(content, target_line):
     """Remove or comment out G28 homing commands ONLY BEFORE the target line."""
     modified_content = []
-    g28_pattern = re.compile(r'^\s*G28', re.IGNORECASE)
     g28_count = 0
     
     for i, line in enumerate(content):
-        if i < target_line and g28_pattern.match(line.strip()):
+        if i < target_line and G28_PATTERN.match(line.strip()):
             modified_content.append('; REMOVED G28: ' + line)
             g28_count += 1
         else:
@@ -679,8 +2236,12 @@ def add_resume_header(content, target_z, actual_z, g28_count, z_moves_count, exe
     
     return header_lines + content
 
-def process_gcode_content(content_str, target_z_height, original_filename='unknown.gcode'):
-    """Process G-code content and return modified content with statistics."""
+def process_gcode_content(content_str, target_z_height, original_filename='unknown.gcode', layer_index=None):
+    """Process G-code content and return modified content with statistics.
+    
+    With layer_index the resume starts at that (0-based) layer instead of at
+    target_z_height, which then becomes the layer's Z.
+    """
     content = content_str.split('\n')
     
     # Find the start point (first "; Filament gcode")
@@ -688,30 +2249,11 @@ def process_gcode_content(content_str, target_z_height, original_filename='unkno
     if filament_start is None:
         filament_start = 0
     
-    # Find all layer changes with Z heights
-    layer_changes = find_layer_changes('\n'.join(content))
-    
-    if not layer_changes:
-        # Fallback to old method if no LAYER_CHANGE comments found
-        layer_lines = find_layer_lines(content)
-        if not layer_lines:
-            raise ValueError("No Z-axis movements or layer changes found in the file.")
-        
-        # Convert old format to new format for compatibility
-        for line_num, z_height, line_content in layer_lines:
-            target_line = line_num
-            actual_z = z_height
-            if z_height >= target_z_height:
-                break
-        else:
-            max_z = max(z for _, z, _ in layer_lines)
-            raise ValueError(f"Target Z height {target_z_height}mm not reached. Maximum Z in file: {max_z}mm")
-    else:
-        # Find the target layer using LAYER_CHANGE comments
-        target_line, actual_z = find_target_layer_line_by_z_height(layer_changes, target_z_height)
-        if target_line is None:
-            max_z = max(layer['zHeight'] for layer in layer_changes)
-            raise ValueError(f"Target Z height {target_z_height}mm not reached. Maximum Z in file: {max_z}mm")
+    # Find all layer changes with Z heights (any slicer dialect, one pass)
+    dialect, layer_changes = detect_layers(content)
+    target_line, actual_z = find_target_layer(layer_changes, target_z_height, layer_index)
+    if layer_index is not None:
+        target_z_height = actual_z
     
     # ONLY process content BEFORE the target line
     # Remove G28 commands only before target line
@@ -731,8 +2273,7 @@ def process_gcode_content(content_str, target_z_height, original_filename='unkno
     commented_lines = target_line - filament_start
     
     # Generate output filename
-    base_name = os.path.splitext(original_filename)[0]
-    output_filename = f"{base_name}_resume_Z{target_z_height}mm.gcode"
+    output_filename = resume_filename(original_filename, target_z_height, layer_index)
     
     return {
         'content': '\n'.join(modified_content),
@@ -746,10 +2287,154 @@ def process_gcode_content(content_str, target_z_height, original_filename='unkno
             'target_z': target_z_height,
             'original_filename': original_filename,
             'total_lines': len(modified_content),
-            'target_line': target_line
+            'target_line': target_line,
+            'layer_index': layer_index
         }
     }
 
+def find_target_layer(layers, target_z_height, layer_index=None):
+    """Return the 0-based target line and actual Z for a target layer.
+    
+    layer_index (0-based) selects the layer directly, which is the only way to
+    address a layer whose Z repeats (sequential / complete-object prints);
+    otherwise the first layer at or above target_z_height is used.
+    """
+    if not layers:
+        raise ValueError("No Z-axis movements or layer changes found in the file.")
+    if layer_index is not None:
+        if not 0 <= layer_index < len(layers):
+            raise ValueError(f"Layer {layer_index} out of range: the file has {len(layers)} layers")
+        return layers[layer_index]['lineNumber'] - 1, layers[layer_index]['zHeight']
+    target_line, actual_z = find_target_layer_line_by_z_height(layers, target_z_height)
+    if target_line is None:
+        max_z = max(layer['zHeight'] for layer in layers)
+        raise ValueError(f"Target Z height {target_z_height}mm not reached. Maximum Z in file: {max_z}mm")
+    return target_line, actual_z
+
+def find_resume_layer(filepath, byte_offset=None, line_number=None, printer_cfg_path=None):
+    """Return the 0-based index of the layer enclosing a file position.
+    
+    byte_offset is what Klipper's virtual_sdcard reports as file_position: the
+    start of the next line to read, so the layer is found from the byte before
+    it. A position exactly at a layer's first byte therefore resolves to the
+    previous layer, whose last moves may still have been in the motion queue.
+    line_number is the 1-based line being printed, so a layer's own first line
+    belongs to it. Positions before the first layer resolve to the first layer.
+    Pass the result to process_gcode_file() as layer_index.
+    """
+    index = get_line_index(filepath, printer_cfg_path)
+    layers = index['layers']
+    if not layers:
+        raise ValueError("No Z-axis movements or layer changes found in the file.")
+    
+    if byte_offset is not None:
+        position = bisect.bisect_right([layer['byteOffset'] for layer in layers], byte_offset - 1)
+    elif line_number is not None:
+        position = bisect.bisect_right([layer['lineNumber'] for layer in layers], line_number)
+    else:
+        raise ValueError("A byte offset or a line number is required")
+    return max(position - 1, 0)
+
+def process_gcode_file(filepath, target_z_height, output, original_filename=None, compress=False,
+                       layer_index=None, printer_cfg_path=None):
+    """Stream a G-code file into a resume file written to the binary stream output.
+    
+    Produces the same output as process_gcode_content() but never holds the file
+    in memory: the cached line index supplies the target line and the header
+    statistics, the lines before the target are rewritten one by one and the
+    rest of the file is copied through. Returns the result without 'content'.
+    layer_index selects the target layer directly, as in process_gcode_content().
+    printer_cfg_path is passed on to get_line_index().
+    """
+    if original_filename is None:
+        original_filename = os.path.basename(filepath)
+    
+    index = get_line_index(filepath, printer_cfg_path)
+    target_line, actual_z = find_target_layer(index['layers'], target_z_height, layer_index)
+    if layer_index is not None:
+        target_z_height = actual_z
+    filament_start = index['filament_start'] or 0
+    
+    g28_count = bisect.bisect_left(index['g28_lines'], target_line)
+    z_moves_count = bisect.bisect_left(index['z_move_lines'], target_line)
+    exec_blocks_count = bisect.bisect_left(index['exec_block_ends'], target_line)
+    header_lines = add_resume_header([], target_z_height, actual_z, g28_count, z_moves_count,
+                                     exec_blocks_count, original_filename)
+    
+    if compress:
+        output = gzip.GzipFile(fileobj=output, mode='wb')
+    
+    output.write(('\n'.join(header_lines) + '\n').encode('utf-8'))
+    g28_lines = set(index['g28_lines'][:g28_count])
+    z_move_lines = set(index['z_move_lines'][:z_moves_count])
+    
+    with open_gcode_stream(filepath) as f:
+        for i in range(target_line):
+            raw_line = f.readline()
+            if not raw_line:
+                break
+            if raw_line.endswith(b'\r\n'):
+                raw_line = raw_line[:-2] + b'\n'
+            if i in g28_lines:
+                output.write(b'; REMOVED G28: ' + raw_line)
+            elif i in z_move_lines:
+                output.write(b'; REMOVED Z-MOVE: ' + raw_line)
+            elif i >= filament_start and not raw_line.strip().startswith(b';'):
+                output.write(b'; SKIPPED: ' + raw_line)
+            else:
+                output.write(raw_line)
+        
+        # Everything from the target layer on is unchanged
+        if index['crlf']:
+            for raw_line in f:
+                output.write(raw_line[:-2] + b'\n' if raw_line.endswith(b'\r\n') else raw_line)
+        else:
+            shutil.copyfileobj(f, output, 1024 * 1024)
+    
+    if compress:
+        output.close()
+    
+    output_filename = resume_filename(original_filename, target_z_height, layer_index) + ('.gz' if compress else '')
+    
+    return {
+        'filename': output_filename,
+        'stats': {
+            'g28_count': g28_count,
+            'z_moves_count': z_moves_count,
+            'exec_blocks_count': exec_blocks_count,
+            'commented_lines': target_line - filament_start,
+            'actual_z': actual_z,
+            'target_z': target_z_height,
+            'original_filename': original_filename,
+            'total_lines': len(header_lines) + index['total_lines'],
+            'target_line': target_line,
+            'layer_index': layer_index
+        }
+    }
+
+def process_gcode_file_legacy(filepath, target_z_height, output, original_filename=None, compress=False,
+                              layer_index=None):
+    """process_gcode_file() equivalent built on process_gcode_content().
+    
+    Reads the whole file into memory; kept as the reference oracle for the
+    streaming engine (--legacy-engine, layer_resume_diffcheck.py).
+    """
+    if original_filename is None:
+        original_filename = os.path.basename(filepath)
+    
+    with io.TextIOWrapper(open_gcode_stream(filepath), encoding='utf-8', errors='ignore') as f:
+        content = f.read()
+    
+    result = process_gcode_content(content, target_z_height, original_filename, layer_index)
+    data = result.pop('content').encode('utf-8')
+    if compress:
+        with gzip.GzipFile(fileobj=output, mode='wb') as gz:
+            gz.write(data)
+        result['filename'] += '.gz'
+    else:
+        output.write(data)
+    return result
+
 def find_available_port(start_port=8081, max_attempts=20):
     """Find an available port starting from start_port."""
     for port in range(start_port, start_port + max_attempts):
@@ -779,9 +2464,21 @@ def open_browser_tab(url, delay=3):
     thread = threading.Thread(target=delayed_open, daemon=True)
     thread.start()
 
-def start_web_server(port=8081, open_browser_tab_flag=True):
+def start_web_server(port=8081, open_browser_tab_flag=True, cache_dir=None,
+                     cache_max_bytes=RESUME_CACHE_MAX_BYTES, roots=None,
+                     workers_per_root=WORKERS_PER_ROOT, max_workers=MAX_WORKERS):
     """Start the web server for the GUI."""
-    global server_instance
+    global server_instance, resume_cache
+    
+    configure_printer_roots(roots or [(DEFAULT_ROOT_NAME, HOME_DIR)], workers_per_root, max_workers)
+    if cache_dir is None:
+        cache_dir = printer_roots[0].resume_cache_dir
+    
+    if cache_max_bytes > 0:
+        try:
+            resume_cache = ResumeCache(cache_dir, cache_max_bytes)
+        except OSError as e:
+            print(f"⚠️  Resume cache disabled: {e}")
     
     # Always try to find an available port, starting from the requested port
     try:
@@ -794,7 +2491,7 @@ def start_web_server(port=8081, open_browser_tab_flag=True):
     server_address = ('0.0.0.0', available_port)
     
     try:
-        httpd = HTTPServer(server_address, LayerResumeHTTPHandler)
+        httpd = ThreadingHTTPServer(server_address, LayerResumeHTTPHandler)
         server_instance = httpd  # Store global reference for shutdown
     except OSError as e:
         print(f"❌ Failed to bind to port {available_port}: {e}")
@@ -806,9 +2503,13 @@ def start_web_server(port=8081, open_browser_tab_flag=True):
     print(f"📅 Date: 2025-07-09 18:57:19 UTC")
     print(f"👤 User: xboxhacker")
     print(f"🌐 Server: http://0.0.0.0:{available_port}")
-    print(f"📁 G-codes Directory: /home/biqu/printer_data/gcodes")
-    print(f"🏠 Home Directory: /home/biqu")
-    print(f"📄 HTML File: /home/biqu/printer_data/config/START_AT_LAYER/layer_resume_gui.html")
+    for root in printer_roots:
+        print(f"🖨️  Printer '{root.name}': {root.home_dir} ({root.workers} workers)")
+        print(f"📁 G-codes Directory: {root.gcodes_dir}")
+    print(f"⚙️  Workers: {max_workers} in total")
+    print(f"📄 HTML File: {HTML_PATH}")
+    if resume_cache:
+        print(f"💾 Resume Cache: {resume_cache.cache_dir} ({resume_cache.max_bytes // (1024 * 1024)} MB)")
     print("⏰ Auto-shutdown: Server will close 30 seconds after processing")
     print("🛑 Manual shutdown: Use 'Terminate Server' button in GUI")
     print("=" * 70)
@@ -840,6 +2541,8 @@ def start_web_server(port=8081, open_browser_tab_flag=True):
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user.")
+    finally:
+        flush_resume_cache()
     
     return available_port
 
@@ -852,6 +2555,7 @@ Usage:
   Web GUI:        python3 start_at_layer_web.py --web
   No Browser:     python3 start_at_layer_web.py --web --no-browser
   Custom Port:    python3 start_at_layer_web.py --web --port 8082
+  Printer farm:   python3 start_at_layer_web.py --web --root veho=/home/biqu --root voron=/mnt/voron/home/pi
 
 Setup Instructions:
   1. Ensure layer_resume_gui.html is in /home/biqu/printer_data/config/START_AT_LAYER/
@@ -866,15 +2570,22 @@ Port Selection:
   
 Features:
   - LAYER_CHANGE and Z: comment parsing for accurate layer detection
+  - Also detects Cura (;LAYER:n) and Simplify3D (; layer n, Z = z) layers in the same pass
   - Auto browser tab opening
   - Network accessible interface
   - File browser for G-code selection
-  - Fallback to G-code Z moves if no LAYER_CHANGE comments found
+  - Fallback to G-code Z moves (ignoring Z-hops) if no layer comments found
   - ONLY modifies content BEFORE selected layer height
   - Comments out ALL Z-moves before target layer (including in executable blocks)
   - Auto-shutdown 30 seconds after file processing
   - Manual termination button in GUI
   - Progress bar for both reading layers and processing
+  - Cache of generated resume files (repeat requests are served instantly)
+  - Reads .gcode.gz, .gcode.zst and binary .bgcode files, decoded on the fly
+  - Optional gzip-compressed output
+  - Resume from a byte offset (Klipper's file_position) or line number instead of a Z height
+  - Farm mode: one server for several printers, with fair per-printer worker quotas
+  - Toolpath preview of the selected layer (and the one below it), requires numpy
         """
     )
     
@@ -884,11 +2595,45 @@ Features:
                        help='Do not open browser automatically')
     parser.add_argument('--port', type=int, default=8081,
                        help='Starting port for web server (default: 8081, auto-finds if busy)')
+    parser.add_argument('--no-auto-shutdown', action='store_true',
+                       help='Keep the server running after a file has been saved')
+    parser.add_argument('--legacy-engine', action='store_true',
+                       help='Process files with the original in-memory engine instead of streaming')
+    parser.add_argument('--cache-dir', default=None,
+                       help='Directory for cached resume files (default: printer_data/resume_cache '
+                            'in the first printer home)')
+    parser.add_argument('--root', action='append', default=[], metavar='NAME=HOME',
+                       help=f'Printer home directory holding printer_data; repeat for a printer farm '
+                            f'(default: {DEFAULT_ROOT_NAME}={HOME_DIR})')
+    parser.add_argument('--workers-per-root', type=int, default=WORKERS_PER_ROOT,
+                       help=f'Concurrent analyze/process jobs per printer (default: {WORKERS_PER_ROOT})')
+    parser.add_argument('--max-workers', type=int, default=MAX_WORKERS,
+                       help=f'Concurrent analyze/process jobs in total (default: {MAX_WORKERS})')
+    parser.add_argument('--cache-size-mb', type=int, default=RESUME_CACHE_MAX_BYTES // (1024 * 1024),
+                       help='Disk budget for cached resume files in MB, 0 disables the cache (default: 1024)')
     
     args = parser.parse_args()
     
+    roots = []
+    for root in args.root:
+        name, separator, home_dir = root.partition('=')
+        if not separator or not name or not home_dir:
+            parser.error(f"--root expects NAME=HOME, got '{root}'")
+        roots.append((name, home_dir))
+    if args.workers_per_root < 1:
+        parser.error("--workers-per-root must be at least 1")
+    if args.max_workers < 1:
+        parser.error("--max-workers must be at least 1")
+    
     if args.web:
-        actual_port = start_web_server(args.port, open_browser_tab_flag=not args.no_browser)
+        global auto_shutdown, use_legacy_engine
+        auto_shutdown = not args.no_auto_shutdown
+        use_legacy_engine = args.legacy_engine
+        actual_port = start_web_server(args.port, open_browser_tab_flag=not args.no_browser,
+                                       cache_dir=args.cache_dir,
+                                       cache_max_bytes=args.cache_size_mb * 1024 * 1024,
+                                       roots=roots, workers_per_root=args.workers_per_root,
+                                       max_workers=args.max_workers)
         if actual_port:
             veho_url = f"http://veho.local:{actual_port}/layer_resume_gui.html"
             print(f'\n🔗 Layer Resume GUI: {veho_url}')